@@ -0,0 +1,64 @@
+"""
+Admission control for analysis bodies: how much memory a body will take to
+analyze is estimated from its size and shape before any DataFrame is built.
+
+- JSON: decoding creates a Python object per value and a dict per row (for
+  the row layout), which dwarfs the body and the frame built from them; the
+  value count comes from the commas, the row count from the braces (values
+  containing either only raise the estimate).
+- Arrow streams: the frame shares or copies the body's buffers.
+
+A body within the per-request budget is analyzed in memory. Over it, rows and
+Arrow streams are analyzed in streaming mode: decoded in chunks sized to fit
+the budget and run through the chunked analyzer (see streaming.py) with
+sketches, so memory is bounded by the chunk and the body itself. Anything else
+(the column layout, or a body that alone fills the budget) is rejected.
+"""
+from typing import Optional, Tuple
+
+from ingest import ARROW_STREAM_CONTENT_TYPE, IngestError, arrow_row_count
+
+# Measured peaks of the in-memory pipeline, rounded up
+JSON_VALUE_BYTES = 128
+JSON_ROW_BYTES = 256
+ARROW_BODY_FACTOR = 2
+
+# Streaming mode leaves half the budget (after the body) to the chunk
+# analyzer's state; chunks never go below MIN_CHUNK_ROWS rows
+CHUNK_SHARE = 0.5
+MIN_CHUNK_ROWS = 1_000
+
+
+class OverBudget(Exception):
+    """A body that cannot be analyzed within the memory budget, even in streaming mode."""
+
+
+def estimate_memory(body: bytes, content_type: str) -> Tuple[int, int]:
+    """(estimated peak bytes of the in-memory analysis, estimated rows) of a body."""
+    if content_type == ARROW_STREAM_CONTENT_TYPE:
+        try:
+            rows = arrow_row_count(body)
+        except IngestError:
+            rows = 0  # reported by the parser
+        return len(body) * ARROW_BODY_FACTOR, rows
+    rows = max(body.count(b"{") - 1, 0)
+    values = body.count(b",") + 1
+    return values * JSON_VALUE_BYTES + rows * JSON_ROW_BYTES, rows
+
+
+def streaming_chunk_size(body: bytes, content_type: str, estimate: int, rows: int, budget: int,
+                         default: int) -> int:
+    """Rows per chunk for streaming mode (at most default); OverBudget if no chunk fits."""
+    # Decoding JSON holds the body and its text at once
+    held = len(body) * (1 if content_type == ARROW_STREAM_CONTENT_TYPE else 2)
+    row_bytes = estimate / max(rows, 1)
+    chunk_rows = int((budget - held) * CHUNK_SHARE / row_bytes) if budget > held else 0
+    if chunk_rows < min(MIN_CHUNK_ROWS, max(rows, 1)):
+        raise OverBudget(over_budget_message(estimate, budget))
+    return min(chunk_rows, default)
+
+
+def over_budget_message(estimate: int, budget: int, hint: Optional[str] = None) -> str:
+    message = (f"Payload needs an estimated {estimate / 2 ** 20:.0f} MB to analyze, "
+               f"over the engine's memory budget of {budget / 2 ** 20:.0f} MB per request")
+    return f"{message}; {hint}" if hint else message
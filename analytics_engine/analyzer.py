@@ -1,78 +1,160 @@
 import pandas as pd
-import numpy as np
+from contextlib import nullcontext
 from typing import Any, Dict
+from dates import detect_date_format
+from ingest import RECORD_COUNT
+from profiling import active_profile
+from sketches import HyperLogLog
 
-def analyze_dataframe(df):
+def has_id_name(col):
+    """True if the column name suggests an identifier (id, key, code, ...)."""
+    col_name_lower = str(col).lower()
+    return any(x in col_name_lower for x in ['id', 'key', 'code', 'index', 'pk'])
+
+def column_info(col, dtype, unique_count, null_count, row_count, stats=None):
+    """
+    Builds one analysis["columns"] entry from pre-computed column statistics.
+    stats is (min, max, mean) for numeric columns; missing values become 0.
+    Shared by analyze_dataframe and the chunked CSV profiler.
+    """
+    unique_ratio = unique_count / row_count if row_count > 0 else 0
+
+    # It is categorical if:
+    # 1. It is string/object and has few unique values (absolute < 50 OR ratio < 5% for large data)
+    # 2. It is numeric but clearly used as a category (very few unique values, e.g. < 10)
+    # 3. AND it is NOT an ID column
+
+    is_potential_cat = (dtype == "string" and (unique_count < 50 or unique_ratio < 0.05)) or \
+                       (dtype == "numeric" and unique_count < 10)
+
+    is_categorical = is_potential_cat and (dtype != "id")
+
+    col_info: Dict[str, Any] = {
+        "name": str(col),
+        "type": str(dtype),
+        "is_categorical": bool(is_categorical),
+        "unique_count": int(unique_count),
+        "null_count": int(null_count),
+        "min": None,
+        "max": None,
+        "mean": None
+    }
+
+    if dtype == "numeric":
+        try:
+            col_info["min"], col_info["max"], col_info["mean"] = [
+                float(v) if v is not None and not pd.isna(v) else 0 for v in (stats or (None, None, None))
+            ]
+        except Exception as e:
+            # Fallback for weird data types
+            col_info["min"] = 0
+            col_info["max"] = 0
+            col_info["mean"] = 0
+
+    return col_info
+
+def _numeric_stats(df, numeric_positions):
+    """
+    min/max/mean for all numeric columns at once (blockwise reductions over
+    the numeric sub-frame). Falls back to per-column reductions when a column
+    has a dtype the frame-wide path cannot reduce.
+    """
+    if not numeric_positions:
+        return {}
+    numeric_df = df.iloc[:, numeric_positions]
+    try:
+        mins = numeric_df.min().to_numpy()
+        maxs = numeric_df.max().to_numpy()
+        means = numeric_df.mean().to_numpy()
+        return {pos: (mins[i], maxs[i], means[i]) for i, pos in enumerate(numeric_positions)}
+    except Exception:
+        stats = {}
+        for pos in numeric_positions:
+            col_data = df.iloc[:, pos]
+            try:
+                stats[pos] = (col_data.min(), col_data.max(), col_data.mean())
+            except Exception:
+                # A column that cannot be reduced (e.g. mixed objects) gets no stats
+                stats[pos] = None
+        return stats
+
+def _approximate_unique_counts(df):
+    """HyperLogLog estimates of each column's distinct count, and their error bounds."""
+    counts, errors = [], []
+    non_null = len(df) - df.isna().sum().to_numpy()
+    for pos in range(df.shape[1]):
+        sketch = HyperLogLog.of(df.iloc[:, pos])
+        # An estimate can overshoot; there are never more distinct values than values
+        counts.append(min(sketch.estimate(), int(non_null[pos])))
+        errors.append(sketch.error_bound())
+    return counts, errors
+
+def analyze_dataframe(df, date_cache=None, approximate=False):
     """
     Analyzes a pandas DataFrame and returns metadata about its columns.
+    Per-column statistics (null counts, unique counts, min/max/mean) are
+    computed once for the whole frame instead of column by column.
+    If a DateCache is given, the detected format of each date column is
+    recorded in it so chart builders can reuse it.
+    A frame without a "Record Count" column gets the entry for the virtual
+    one (a column of 1s) at the end, as if it had been stored.
+    With approximate=True unique counts are HyperLogLog estimates and each
+    column entry gets its "unique_count_error" (~95% confidence).
     """
     analysis = {
         "columns": [],
         "row_count": len(df)
     }
 
-    for col in df.columns:
-        col_data = df[col]
-        
-        # Determine data type
-        dtype = "string"
-        if pd.api.types.is_numeric_dtype(col_data):
-            # Check if it looks like an ID (sequential or large integers with low volume of unique values - wait, actually unique values == len is ID-like, but could be Price too)
-            # Only classify as ID if name contains "id" or "code" OR if explicitly sequential integers starting from 0/1
-            col_name_lower = str(col).lower()
-            is_id_name = any(x in col_name_lower for x in ['id', 'key', 'code', 'index', 'pk'])
-            
-            if pd.api.types.is_integer_dtype(col_data) and col_data.nunique() == len(df) and is_id_name:
-                dtype = "id"
+    row_count = len(df)
+    null_counts = df.isna().sum().to_numpy()
+    if approximate:
+        unique_counts, unique_errors = _approximate_unique_counts(df)
+    else:
+        unique_counts = df.nunique().to_numpy()
+    is_numeric = [pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes]
+    numeric_stats = _numeric_stats(df, [pos for pos, numeric in enumerate(is_numeric) if numeric])
+
+    profile = active_profile()
+    for pos, col in enumerate(df.columns):
+        # Timed per column only when the request is profiled (see profiling.py)
+        with profile.column(col) if profile is not None else nullcontext():
+            col_data = df.iloc[:, pos]
+            unique_count = int(unique_counts[pos])
+
+            # Determine data type
+            dtype = "string"
+            if is_numeric[pos]:
+                # Check if it looks like an ID (sequential or large integers with low volume of unique values - wait, actually unique values == len is ID-like, but could be Price too)
+                # Only classify as ID if name contains "id" or "code" OR if explicitly sequential integers starting from 0/1
+                all_unique = unique_count == row_count
+                if approximate:
+                    all_unique = row_count - unique_count <= unique_errors[pos]
+                if pd.api.types.is_integer_dtype(col_data) and all_unique and has_id_name(col):
+                    dtype = "id"
+                else:
+                    dtype = "numeric"
+            elif pd.api.types.is_datetime64_any_dtype(col_data):
+                dtype = "date"
             else:
-                dtype = "numeric"
-        elif pd.api.types.is_datetime64_any_dtype(col_data):
-            dtype = "date"
-        else:
-            # Try to parse as date if it's a string
-            try:
-                temp_dates = pd.to_datetime(col_data, errors='coerce')
-                if temp_dates.notna().sum() > len(df) * 0.8: # If 80% are dates
+                # Try to parse as date if it's a string (decided from a sample)
+                is_date, fmt = detect_date_format(col_data)
+                if is_date:
                     dtype = "date"
-            except:
-                pass
-        
-        # Categorical check - Improved Logic
-        unique_count = col_data.nunique()
-        unique_ratio = unique_count / len(df) if len(df) > 0 else 0
-        
-        # It is categorical if:
-        # 1. It is string/object and has few unique values (absolute < 50 OR ratio < 5% for large data)
-        # 2. It is numeric but clearly used as a category (very few unique values, e.g. < 10)
-        # 3. AND it is NOT an ID column
-        
-        is_potential_cat = (dtype == "string" and (unique_count < 50 or unique_ratio < 0.05)) or \
-                           (dtype == "numeric" and unique_count < 10)
-                           
-        is_categorical = is_potential_cat and (dtype != "id")
-
-        col_info: Dict[str, Any] = {
-            "name": str(col),
-            "type": str(dtype),
-            "is_categorical": bool(is_categorical),
-            "unique_count": int(unique_count),
-            "null_count": int(col_data.isna().sum()),
-            "min": None,
-            "max": None,
-            "mean": None
-        }
-        
-        if dtype == "numeric":
-            try:
-                col_info["min"] = float(col_data.min()) if not col_data.empty and not pd.isna(col_data.min()) else 0
-                col_info["max"] = float(col_data.max()) if not col_data.empty and not pd.isna(col_data.max()) else 0
-                col_info["mean"] = float(col_data.mean()) if not col_data.empty and not pd.isna(col_data.mean()) else 0
-            except Exception as e:
-                # Fallback for weird data types
-                col_info["min"] = 0
-                col_info["max"] = 0
-                col_info["mean"] = 0
-
-        analysis["columns"].append(col_info)
+                    if date_cache is not None:
+                        date_cache.formats[col] = fmt
+
+            stats = numeric_stats.get(pos) if dtype == "numeric" and row_count > 0 else None
+            col_info = column_info(col, dtype, unique_count, int(null_counts[pos]), row_count, stats)
+            if approximate:
+                col_info["unique_count_error"] = unique_errors[pos]
+
+            analysis["columns"].append(col_info)
+
+    if RECORD_COUNT not in df.columns:
+        analysis["columns"].append(column_info(RECORD_COUNT, "numeric", min(row_count, 1), 0, row_count,
+                                                   (1, 1, 1) if row_count > 0 else None))
+        if approximate:
+            analysis["columns"][-1]["unique_count_error"] = 0
         
     return analysis
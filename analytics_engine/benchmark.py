@@ -0,0 +1,252 @@
+"""
+In-process benchmark of the analysis pipeline over the bundled datasets.
+
+For every dataset in the repository root it measures latency (median and max
+of --repeat runs, after one warm-up run) and peak traced memory of each stage:
+analyze_dataframe, recommend_charts, compact_frame, build_chart_data, all of them
+("pipeline"), and for the bundled files the full /analyze request handling
+("analyze_request": JSON body -> DataFrame -> result -> response bytes).
+Synthetic copies of each schema, resampled with a fixed seed to the row
+counts given by --sizes, show how the stages scale.
+
+Peak memory is measured in a separate run under tracemalloc (Python and numpy
+allocations; Arrow-backed strings are allocated outside its view).
+
+Usage (from analytics_engine/):
+    python benchmark.py --save-baseline bench_baseline.json
+    python benchmark.py --baseline bench_baseline.json --threshold 0.2
+
+With --baseline the run exits with status 1 if any stage got slower (or used
+more memory) than the baseline by more than the threshold. Baselines are
+machine-specific, so record one on the machine that runs the comparison.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from analyzer import analyze_dataframe
+from chart_data import build_chart_data, summed_columns
+from chart_recommender import recommend_charts
+from correlation import correlation_summary
+from dates import DateCache
+from ingest import compact_frame, frame_from_rows
+from pipeline import analyze_body, prepare_frame
+from serialize import encode_result
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Bundled dataset -> projectType it is analyzed as
+DATASETS = {
+    "maintenance.csv": "maintenance",
+    "vehicle_emission_dataset.csv": "emission",
+    "WA_Fn-UseC_-Telco-Customer-Churn.csv": "general",
+    "retail_sales_dataset.csv": "retail",
+    "employee_performance_data.csv": "general",
+    "employee_performance_data_categorical.csv": "general",
+}
+
+STAGES = ["analyze_dataframe", "recommend_charts", "compact_frame", "build_chart_data", "pipeline", "analyze_request"]
+
+SEED = 0
+
+
+def load_dataset(name):
+    """The bundled CSV as the request body /analyze gets, and the frame built from it."""
+    df = pd.read_csv(os.path.join(DATA_DIR, name), encoding="utf-8-sig")
+    rows = json.loads(df.to_json(orient="records"))
+    return rows, prepare_frame(frame_from_rows(rows))
+
+
+def scale_frame(df, rows):
+    """A synthetic copy of df with `rows` rows resampled from it (fixed seed)."""
+    rng = np.random.default_rng(SEED)
+    return df.iloc[rng.integers(0, len(df), rows)].reset_index(drop=True)
+
+
+def run_pipeline(df, project_type, measure):
+    """One pass of the in-memory stages; measure(stage, fn) runs and records fn."""
+    df = df.copy()  # compact_frame changes dtypes in place
+    start = time.perf_counter()
+    date_cache = DateCache()
+
+    def profile():
+        analysis = analyze_dataframe(df, date_cache)
+        return analysis, correlation_summary(df, analysis)
+
+    analysis, correlation = measure("analyze_dataframe", profile)
+    recommendations = measure("recommend_charts", lambda: recommend_charts(analysis, project_type, correlation))
+    measure("compact_frame", lambda: compact_frame(df, analysis, summed_columns(recommendations)))
+    measure("build_chart_data", lambda: build_chart_data(recommendations, df, analysis, date_cache))
+    return time.perf_counter() - start
+
+
+def run_request(body, measure):
+    def handle():
+        result, _ = analyze_body(body, "application/json", {})
+        return encode_result(result)
+
+    measure("analyze_request", handle)
+
+
+def time_case(df, project_type, body, repeat):
+    """Seconds per stage over `repeat` runs (after one warm-up run)."""
+    samples = {}
+
+    def measure(stage, fn):
+        start = time.perf_counter()
+        result = fn()
+        samples.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    for i in range(repeat + 1):
+        if i == 0:
+            run_pipeline(df, project_type, lambda stage, fn: fn())
+            if body is not None:
+                run_request(body, lambda stage, fn: fn())
+            continue
+        samples.setdefault("pipeline", []).append(run_pipeline(df, project_type, measure))
+        if body is not None:
+            run_request(body, measure)
+    return samples
+
+
+def memory_case(df, project_type, body):
+    """Peak traced bytes allocated during each stage (one run)."""
+    peaks = {}
+
+    def measure(stage, fn):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = fn()
+        peaks[stage] = max(peaks.get(stage, 0), tracemalloc.get_traced_memory()[1] - before)
+        return result
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        run_pipeline(df, project_type, measure)
+        peaks["pipeline"] = tracemalloc.get_traced_memory()[1] - before
+        if body is not None:
+            run_request(body, measure)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def bench_case(case, df, project_type, body, repeat):
+    samples = time_case(df, project_type, body, repeat)
+    peaks = memory_case(df, project_type, body)
+    return {
+        "case": case,
+        "rows": len(df),
+        "columns": df.shape[1],
+        "stages": {
+            stage: {
+                "median_ms": round(statistics.median(samples[stage]) * 1000, 3),
+                "max_ms": round(max(samples[stage]) * 1000, 3),
+                "peak_mb": round(peaks[stage] / 2**20, 3),
+            }
+            for stage in STAGES if stage in samples
+        },
+    }
+
+
+def compare(results, baseline, threshold, memory_threshold, min_ms, min_mb):
+    """Regressions of results against baseline, as printable lines."""
+    base_cases = {r["case"]: r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = base_cases.get(result["case"])
+        if base is None:
+            continue
+        for stage, stats in result["stages"].items():
+            base_stats = base["stages"].get(stage)
+            if base_stats is None:
+                continue
+            now_ms, was_ms = stats["median_ms"], base_stats["median_ms"]
+            if now_ms > was_ms * (1 + threshold) and now_ms - was_ms > min_ms:
+                regressions.append(f"{result['case']} {stage}: {was_ms:.1f} ms -> {now_ms:.1f} ms")
+            now_mb, was_mb = stats["peak_mb"], base_stats["peak_mb"]
+            if now_mb > was_mb * (1 + memory_threshold) and now_mb - was_mb > min_mb:
+                regressions.append(f"{result['case']} {stage}: {was_mb:.1f} MB -> {now_mb:.1f} MB")
+    return regressions
+
+
+def print_result(result):
+    for stage, stats in result["stages"].items():
+        print(f"{result['case']:<52} {result['rows']:>9} {stage:<18} "
+              f"{stats['median_ms']:>10.1f} {stats['max_ms']:>10.1f} {stats['peak_mb']:>9.1f}")
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per bundled dataset")
+    parser.add_argument("--scaled-repeat", type=int, default=3, help="timed runs per synthetic dataset")
+    parser.add_argument("--sizes", default="100000,1000000",
+                        help="comma-separated row counts for synthetic copies ('' for none)")
+    parser.add_argument("--datasets", default=",".join(DATASETS), help="comma-separated bundled files to use")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--save-baseline", help="write the results as the baseline to this file")
+    parser.add_argument("--baseline", help="compare against this baseline and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative latency increase")
+    parser.add_argument("--memory-threshold", type=float, default=0.2, help="allowed relative peak memory increase")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="ignore latency changes smaller than this")
+    parser.add_argument("--min-mb", type=float, default=1.0, help="ignore memory changes smaller than this")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    names = [n for n in args.datasets.split(",") if n.strip()]
+    unknown = [n for n in names if n not in DATASETS]
+    if unknown:
+        parser.error(f"unknown dataset(s): {', '.join(unknown)}")
+
+    print(f"{'case':<52} {'rows':>9} {'stage':<18} {'median ms':>10} {'max ms':>10} {'peak MB':>9}")
+    results = []
+    for name in names:
+        project_type = DATASETS[name]
+        rows, df = load_dataset(name)
+        body = json.dumps({"data": rows, "projectType": project_type}).encode("utf-8")
+        result = bench_case(name, df, project_type, body, args.repeat)
+        results.append(result)
+        print_result(result)
+
+        for size in sizes:
+            result = bench_case(f"{name}@{size}", scale_frame(df, size), project_type, None, args.scaled_repeat)
+            results.append(result)
+            print_result(result)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "results": results,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.memory_threshold, args.min_ms, args.min_mb)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
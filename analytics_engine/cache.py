@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+
+def dataset_key(parts: Iterable[bytes], *params: Any) -> str:
+    """
+    Content address for a request: BLAKE2b over the dataset bytes plus the
+    parameters that change the result (projectType, engine version, ...).
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        h.update(part)
+    for param in params:
+        h.update(b"\0")
+        h.update(str(param).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Serialized /analyze responses keyed by dataset_key().
+
+    The in-memory tier is an LRU bounded by total bytes. If disk_dir is set,
+    every entry is also written there (one file per key) so results survive
+    restarts; the disk tier keeps at most disk_max_bytes, dropping the
+    least recently written files first.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return body
+
+        body = self._read_disk(key)
+        with self._lock:
+            if body is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, body)
+        return body
+
+    def put(self, key: str, body: bytes):
+        with self._lock:
+            self._store(key, body)
+        self._write_disk(key, body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+            }
+
+    def _store(self, key: str, body: bytes):
+        # Caller holds the lock. Entries larger than the whole budget are not kept in memory.
+        if len(body) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._entries[key] = body
+        self._bytes += len(body)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, body: bytes):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, path)  # atomic, so readers never see a partial file
+        except OSError:
+            return
+        if self.disk_max_bytes is not None:
+            self._trim_disk()
+
+    def _trim_disk(self):
+        try:
+            files = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir) if name.endswith(".json")]
+            files = sorted(((os.stat(p).st_mtime, os.stat(p).st_size, p) for p in files))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,330 @@
+"""
+Fills in the data for the charts and KPIs declared by recommend_charts.
+
+Grouped aggregations are not run chart by chart: every chart and KPI first
+registers what it needs with an AggregationPlan, the plan runs one groupby per
+distinct key, and each chart then formats its slice of the shared results.
+
+In approximate mode box plot quartiles and histogram counts come from KLL
+sketches (see sketches.py), and each row reports its error bound.
+"""
+import numpy as np
+import pandas as pd
+
+from ingest import RECORD_COUNT
+from metrics import Timings
+from partitioned import partition_pool
+from planner import AggregationPlan
+from rollup import SUM_TOLERANCE, dimension_name
+from sampling import GROUPED_SCATTER_POINTS, SCATTER_POINTS, RowSampler
+from series import fill_date_line, fill_numeric_line
+from sketches import KLLSketch
+
+# Per-category statistics of a box plot
+BOX_PLOT_FUNCS = ["min", "q1", "median", "q3", "max", "count"]
+
+# The exact part of a box plot in approximate mode; quartiles come from sketches
+BOX_PLOT_EXACT_FUNCS = ["min", "max", "count"]
+
+
+def fill_kpis(kpis, stat, row_count, error=None):
+    """
+    Resolves each KPI's declared "agg" spec to a value with stat(column, func)
+    and removes the spec from the KPI. If error(column, func) is given and
+    returns a bound, it is reported as kpi["error"].
+    """
+    for kpi in kpis:
+        spec = kpi.pop("agg", None)
+        if spec is None:
+            continue
+        value = stat(spec["column"], spec["func"])
+        bound = error(spec["column"], spec["func"]) if error else None
+        if bound is not None:
+            kpi["error"] = bound
+        if spec["format"] == "int":
+            kpi["value"] = int(value)
+        elif spec["format"] == "percent":
+            # Share of all rows, computed from the (integer) total
+            kpi["value"] = f"{(int(value) / row_count) * 100:.4f}%"
+        else:
+            kpi["value"] = float(value)
+
+
+def group_comparison_rows(means, x_key):
+    """
+    Turns per-group means (groups x metrics) into one row per metric with a
+    column per group value: [{x_key: "Temp", "0": 300, "1": 400}, ...].
+    """
+    keys = [str(int(g)) if pd.notna(g) else "Unknown" for g in means.index]
+    by_metric = means.to_numpy(dtype=float).T.tolist()
+    return [{x_key: metric, **dict(zip(keys, values))} for metric, values in zip(means.columns, by_metric)]
+
+
+def fill_group_series(chart, sample_df, x_col, y_col, group_col):
+    """Splits sampled points into the chart's series ("dataKey" = group value)."""
+    groups = {value: rows for value, rows in sample_df.groupby(group_col)[[x_col, y_col]]}
+    for series in chart["series"]:
+        rows = groups.get(int(series["dataKey"]))
+        series["data"] = rows.to_dict(orient="records") if rows is not None else []
+
+
+def _box_plot_columns(chart, df, plan):
+    x_col = chart.get("x")
+    y_col = chart.get("y")
+    y_numeric = y_col == plan.count_column or pd.api.types.is_numeric_dtype(df.get(y_col))
+    return x_col and y_col and x_col in df.columns and y_numeric
+
+
+def _line_uses_numeric_x(chart, df):
+    # If X is numeric (e.g. training_hours), use simple X-Y aggregation instead of date parsing.
+    # Numeric columns parsed as dates produce "Jan 1970" and collapse to one point.
+    return chart["x"] in df.columns and pd.api.types.is_numeric_dtype(df[chart["x"]])
+
+
+def _bar_columns(chart):
+    x_col = chart.get("x") or chart.get("nameKey")
+    y_col = chart.get("y") or chart.get("dataKey")
+    agg_func = "mean" if chart.get("agg_type") == "mean" else "sum"
+    return x_col, y_col, agg_func
+
+
+def _frame(df, plan, columns):
+    """The given columns of df, materializing the virtual count column if named."""
+    columns = list(dict.fromkeys(columns))
+    if plan.count_column in columns:
+        return pd.DataFrame({c: plan.column(df, c) for c in columns})
+    return df[columns]
+
+
+def histogram_rows(counts, bins, error=None):
+    rows = [{"range": f"{bins[i]:.0f}-{bins[i+1]:.0f}", "count": int(counts[i])} for i in range(len(counts))]
+    if error is not None:
+        for row in rows:
+            row["count_error"] = error
+    return rows
+
+
+def _box_plot_quartiles(grouped, df, plan, x_col, y_col):
+    """
+    KLL-estimated q1/median/q3 (and their rank error) for the categories in
+    grouped, from one sketch per category.
+    """
+    values = plan.column(df, y_col)
+    positions = values.groupby(df[x_col], observed=True).indices
+    values = pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    quartiles = []
+    for category in grouped[x_col]:
+        sketch = KLLSketch()
+        sketch.update(values[positions[category]])
+        quartiles.append(sketch.quantiles([0.25, 0.5, 0.75]) + [round(sketch.rank_error, 6)])
+    return pd.DataFrame(quartiles, columns=["q1", "median", "q3", "rank_error"], index=grouped.index)
+
+
+def _plan_chart(chart, plan, df, date_cache, approximate=False):
+    """Registers the grouped aggregations a chart needs."""
+    agg_type = chart.get("agg_type")
+
+    if agg_type == "radar_mean" or agg_type == "multi_bar_mean":
+        if chart.get("group_col") and chart.get("metrics"):
+            plan.need(chart["group_col"], chart["metrics"], "mean")
+
+    elif agg_type in ("scatter_group", "histogram"):
+        pass
+
+    elif chart["type"] in ["bar", "pie", "treemap"]:
+        x_col, y_col, agg_func = _bar_columns(chart)
+        if x_col and y_col:
+            plan.need(x_col, y_col, agg_func)
+
+    elif chart["type"] == "boxPlot":
+        if _box_plot_columns(chart, df, plan):
+            plan.need(chart["x"], chart["y"], *(BOX_PLOT_EXACT_FUNCS if approximate else BOX_PLOT_FUNCS))
+
+    elif chart["type"] in ["line", "area"]:
+        x_col = chart["x"]
+        if _line_uses_numeric_x(chart, df):
+            plan.need(x_col, chart["y"], "mean")
+        else:
+            # Daily totals on the datetime column parsed once per request,
+            # rolled up to the chart's granularity when it is filled
+            key = ("day", x_col)
+            plan.add_key(key, date_cache.parsed(df, x_col).dt.to_period("D"))
+            plan.need(key, chart["y"], "sum")
+
+
+def _fill_chart(chart, plan, df, sampler, approximate=False):
+    """Builds chart["data"] from the plan results (or the frame, for samples)."""
+    agg_type = chart.get("agg_type")
+
+    if agg_type == "radar_mean" or agg_type == "multi_bar_mean":
+        # Multi-variable comparison (Radar/Bar)
+        # Group by Failure (0/1) -> Mean of Metrics -> Transpose
+        group_col = chart.get("group_col")
+        metrics = chart.get("metrics")
+
+        if group_col and metrics:
+            means = pd.DataFrame({metric: plan.get(group_col, metric, "mean") for metric in metrics})
+            chart["data"] = group_comparison_rows(means, chart.get("x"))
+
+    elif agg_type == "scatter_group":
+        # Scatter with grouping
+        # We need to split data into series
+        x_col = chart["x"]
+        y_col = chart["y"]
+        group_col = chart.get("group_col")
+
+        if group_col:
+            # Sample first (every group gets a share), then split the sample once by group value
+            sample_df = sampler.sample(_frame(df, plan, [x_col, y_col, group_col]), GROUPED_SCATTER_POINTS, group_col)
+            fill_group_series(chart, sample_df, x_col, y_col, group_col)
+
+    elif agg_type == "histogram":
+        # Equal-width bins over the metric's non-null values
+        data_to_hist = plan.column(df, chart["metric"]).dropna()
+        if approximate:
+            # Exact range (the sketch tracks min/max), estimated bin counts
+            sketch = KLLSketch()
+            sketch.update(data_to_hist)
+            bins = np.histogram_bin_edges([sketch.min, sketch.max] if sketch.count else [], bins=chart.get("bins", 10))
+            chart["data"] = histogram_rows(sketch.histogram(bins), bins, sketch.count_error())
+        else:
+            counts, bins = partition_pool.histogram(data_to_hist, bins=chart.get("bins", 10))
+            chart["data"] = histogram_rows(counts, bins)
+
+    elif chart["type"] in ["bar", "pie", "treemap"]:
+        x_col, y_col, agg_func = _bar_columns(chart)
+
+        if x_col and y_col:
+            values = plan.get(x_col, y_col, agg_func)
+            if x_col == y_col:
+                # Collision avoidance: Grouping by X and Summing X
+                # Rename the value column to avoid conflict with index
+                agg_df = values.reset_index(name="value")
+                chart["y"] = "value" # Update chart config to read from new column
+            else:
+                agg_df = values.reset_index(name=y_col)
+
+            agg_df = agg_df.sort_values(by=chart["y"], ascending=False).head(10) # Top 10
+            chart["data"] = agg_df.to_dict(orient="records")
+
+    elif chart["type"] in ["line", "area"]:
+        x_col = chart["x"]
+        y_col = chart["y"]
+        if _line_uses_numeric_x(chart, df):
+            fill_numeric_line(chart, plan.get(x_col, y_col, "mean"))
+        else:
+            fill_date_line(chart, plan.get(("day", x_col), y_col, "sum"))
+
+    elif chart["type"] == "scatter":
+        x_col = chart["x"]
+        y_col = chart["y"]
+        # Up to 100 points (or the requested sample size)
+        chart["data"] = sampler.sample(_frame(df, plan, [x_col, y_col]), SCATTER_POINTS).to_dict(orient="records")
+
+    elif chart["type"] == "boxPlot":
+        x_col = chart.get("x")
+        y_col = chart.get("y")
+        if _box_plot_columns(chart, df, plan):
+            funcs = BOX_PLOT_EXACT_FUNCS if approximate else BOX_PLOT_FUNCS
+            stats = pd.DataFrame({func: plan.get(x_col, y_col, func) for func in funcs})
+            # Categories without a numeric value are left out
+            grouped = stats[stats["count"] > 0].reset_index()
+            if not grouped.empty:
+                # Prefer more-representative categories when there are many.
+                grouped = grouped.sort_values(by="count", ascending=False).head(20)
+
+                if approximate:
+                    # Sketch only the categories that are shown
+                    grouped = grouped.join(_box_plot_quartiles(grouped, df, plan, x_col, y_col))
+                    grouped = grouped[[x_col, *BOX_PLOT_FUNCS, "rank_error"]]
+
+                # Frontend expects x-axis key "category"
+                grouped = grouped.rename(columns={x_col: "category"}).drop(columns=["count"])
+
+                # Ensure JSON-serializable plain Python numbers
+                for c in ["min", "q1", "median", "q3", "max"]:
+                    grouped[c] = grouped[c].astype(float)
+
+                chart["data"] = grouped.to_dict(orient="records")
+
+
+def summed_columns(recommendations):
+    """Columns whose values a recommended chart or KPI sums or averages."""
+    columns = set()
+    for chart in recommendations["charts"]:
+        agg_type = chart.get("agg_type")
+        if agg_type == "radar_mean" or agg_type == "multi_bar_mean":
+            columns.update(chart.get("metrics") or [])
+        elif agg_type in ("scatter_group", "histogram"):
+            continue
+        elif chart["type"] in ["bar", "pie", "treemap"]:
+            columns.add(_bar_columns(chart)[1])
+        elif chart["type"] in ["line", "area"]:
+            columns.add(chart.get("y"))
+    for kpi in recommendations["kpis"]:
+        spec = kpi.get("agg")
+        if spec and spec["func"] in ("sum", "mean"):
+            columns.add(spec["column"])
+    columns.discard(None)
+    return columns
+
+
+def build_chart_data(recommendations, df, analysis, date_cache, timings=None, approximate=False, sampler=None,
+                     cube=None):
+    """
+    Fills chart["data"] for every recommended chart and the value of every
+    KPI, sharing one groupby per distinct key across all of them.
+    Point charts draw from one RowSampler (default: seeded, default sizes).
+    Records "aggregate" (planning + shared groupbys) and per-chart fill times
+    in timings, if given.
+    With approximate=True quartiles and histogram counts are sketched, and
+    category-count KPIs report the analysis' unique_count_error.
+    Groupings a rollup cube of df (see rollup.py) covers are read from it.
+    """
+    timings = timings or Timings()
+    sampler = sampler or RowSampler()
+    # Without a stored "Record Count" the metric is virtual (group sizes)
+    plan = AggregationPlan(count_column=RECORD_COUNT if RECORD_COUNT not in df.columns else None, cube=cube)
+    with timings.stage("aggregate"):
+        for chart in recommendations["charts"]:
+            _plan_chart(chart, plan, df, date_cache, approximate)
+        for kpi in recommendations["kpis"]:
+            spec = kpi.get("agg")
+            if spec and spec["func"] != "nunique":
+                plan.need(None, spec["column"], spec["func"])
+
+        plan.execute(df)
+
+    for chart in recommendations["charts"]:
+        with timings.chart(chart["type"]):
+            _fill_chart(chart, plan, df, sampler, approximate)
+
+    # Category counts come from the profile (or a planned groupby on the
+    # column) rather than another pass over the data.
+    unique_counts = {c["name"]: c["unique_count"] for c in analysis["columns"]}
+    unique_errors = {c["name"]: c["unique_count_error"] for c in analysis["columns"] if "unique_count_error" in c}
+
+    def stat(column, func):
+        if func == "nunique":
+            if column in unique_counts:
+                return unique_counts[column]
+            count = plan.group_count(column)
+            return count if count is not None else df[column].nunique()
+        return plan.get(None, column, func)
+
+    def error(column, func):
+        if func == "nunique" and approximate:
+            # A column the profile does not cover was counted exactly
+            return unique_errors.get(column, 0)
+        return None
+
+    fill_kpis(recommendations["kpis"], stat, analysis["row_count"], error)
+    if cube is not None:
+        recommendations["metadata"] = {**recommendations["metadata"], "rollup": {
+            "dimensions": [dimension_name(dim) for dim in cube.dims],
+            "cells": cube.cell_count,
+            "aggregationsFromCube": len(plan.cube_keys),
+            "aggregations": len(plan.needs),
+            "relativeTolerance": SUM_TOLERANCE,
+        }}
+    return recommendations
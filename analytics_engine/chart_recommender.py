@@ -1,10 +1,54 @@
-import numpy as np
 import sys
 
-def recommend_charts(analysis, df, project_type="general"):
+def _kpi(label, kpi_type, column, func, fmt):
+    """
+    A KPI whose value comes from the data: func ("sum", "mean", "nunique") of
+    column, converted by fmt ("int", "float", "percent" = share of all rows).
+    The value is filled in by chart_data.fill_kpis, which also drops "agg".
+    """
+    return {"label": label, "value": None, "type": kpi_type, "agg": {"column": column, "func": func, "format": fmt}}
+
+# |r| at or above this marks a near-duplicate metric (e.g. the same value in two units)
+NEAR_DUPLICATE = 0.999
+
+def _corr(correlation, a, b):
+    """Pearson r of columns a and b from the correlation summary (None if unknown or constant)."""
+    if not correlation or a not in correlation["columns"] or b not in correlation["columns"]:
+        return None
+    names = correlation["columns"]
+    return correlation["matrix"][names.index(a)][names.index(b)]
+
+def _rank_by_correlation(metrics, correlation, target):
+    """metrics by |r| with target, strongest first (unknown as 0; ties keep their order)."""
+    def strength(c):
+        r = _corr(correlation, c["name"], target)
+        return abs(r) if r is not None else 0.0
+    return sorted(metrics, key=strength, reverse=True)
+
+def _variation(column, correlation):
+    """Coefficient of variation (std / |mean|) of a column, 0 if unknown."""
+    if not correlation or column["name"] not in correlation["columns"]:
+        return 0.0
+    std = correlation["std"][correlation["columns"].index(column["name"])]
+    mean = column.get("mean")
+    if std is None or not mean:
+        return 0.0
+    return std / abs(mean)
+
+def _metadata(row_count, correlation, **extra):
+    metadata = {"rowCount": row_count}
+    if correlation:
+        metadata["correlation"] = {**correlation, **extra}
+    return metadata
+
+def recommend_charts(analysis, project_type="general", correlation=None):
     """
     Guarantees 4 unique, diverse charts with SMART metric selection.
     Prioritizes 'Record Count' for distributions to avoid 'Sum of Engine Size' nonsense.
+    Works from the column analysis only: charts and KPIs declare the
+    aggregations they need and chart_data computes them.
+    correlation (see correlation.py) ranks the metrics when given, and is
+    returned in metadata.
     """
     charts = []
     kpis = []
@@ -23,23 +67,31 @@ def recommend_charts(analysis, df, project_type="general"):
         # Exclude failure, device, date, IDs, Year, UDI
         exclude_keywords = ["failure", "record count", "id", "year", "udi", "no"]
         sensor_metrics = [c for c in columns if c["type"] == "numeric" and not any(k in c["name"].lower() for k in exclude_keywords)]
+        # Strongest (point-biserial) correlation with the failure flag first;
+        # other 0/1 flags (failure modes) go after the actual sensor readings
+        target_metadata = {}
+        if failure_col and _corr(correlation, failure_col["name"], failure_col["name"]) is not None:
+            sensor_metrics = _rank_by_correlation(sensor_metrics, correlation, failure_col["name"])
+            sensor_metrics.sort(key=lambda c: c.get("unique_count", 0) <= 2)
+            target_metadata = {
+                "target": failure_col["name"],
+                "method": "point-biserial" if failure_col.get("unique_count") == 2 else "pearson",
+                "targetCorrelation": {s["name"]: _corr(correlation, s["name"], failure_col["name"]) for s in sensor_metrics},
+            }
         
         # KPI 1: Total Records (Use row_count directly)
         kpis.append({"label": "Total Records", "value": row_count, "type": "total"})
 
         if failure_col:
             # KPI 2: Total Failures
-            total_failures = int(df[failure_col["name"]].sum())
-            kpis.append({"label": "Total Failures", "value": total_failures, "type": "total"})
+            kpis.append(_kpi("Total Failures", "total", failure_col["name"], "sum", "int"))
             
             # KPI 3: Failure Rate
-            fail_rate = (total_failures / row_count) * 100
-            kpis.append({"label": "Failure Rate", "value": f"{fail_rate:.4f}%", "type": "percentage"})
+            kpis.append(_kpi("Failure Rate", "percentage", failure_col["name"], "sum", "percent"))
             
             # KPI 4: Active Devices (or similar)
             if device_col:
-                active_devices = df[device_col["name"]].nunique()
-                kpis.append({"label": "Device Types", "value": active_devices, "type": "count"})
+                kpis.append(_kpi("Device Types", "count", device_col["name"], "nunique", "int"))
 
             # Chart 1: Sensor Health Profile (Radar)
             # Compare Avg values of top 5 sensors for Healthy vs Failed
@@ -55,8 +107,8 @@ def recommend_charts(analysis, df, project_type="general"):
                         {"name": "Healthy", "dataKey": "0", "stroke": "#10b981", "fill": "#10b981"},
                         {"name": "Failed", "dataKey": "1", "stroke": "#ef4444", "fill": "#ef4444"}
                     ],
-                    "metrics": sensor_names, # Pass to main.py to fetch data
-                    "agg_type": "radar_mean", # Custom agg for main.py
+                    "metrics": sensor_names, # Pass to chart_data.py to fetch data
+                    "agg_type": "radar_mean", # Custom agg for chart_data.py
                     "group_col": failure_col["name"]
                 })
 
@@ -92,7 +144,7 @@ def recommend_charts(analysis, df, project_type="general"):
                     "group_col": failure_col["name"]
                  })
 
-            return {"charts": charts, "kpis": kpis, "metadata": {"rowCount": row_count}}
+            return {"charts": charts, "kpis": kpis, "metadata": _metadata(row_count, correlation, **target_metadata)}
 
     # --- END SPECIALIZED LOGIC ---
 
@@ -129,6 +181,7 @@ def recommend_charts(analysis, df, project_type="general"):
     # Then distinct high-variance numerics
     if not primary_metric:
         others = [c for c in numeric_cols if c["max"] > 100 and "id" not in c["name"].lower() and "record count" not in c["name"].lower()]
+        others.sort(key=lambda c: _variation(c, correlation), reverse=True)
         primary_metric = others[0] if others else numeric_cols[0]
 
     # 2. Identify "Dimension" Categories
@@ -268,26 +321,32 @@ def recommend_charts(analysis, df, project_type="general"):
             "description": f"Statistical distribution (min, max, median) by category.",
         })
     else:
-        # Histogram
-        try:
-            data_to_hist = df[primary_metric['name']].dropna()
-            if not data_to_hist.empty and data_to_hist.nunique() > 1:
-                counts, bins = np.histogram(data_to_hist, bins=10)
-                hist_json = [{"range": f"{bins[i]:.0f}-{bins[i+1]:.0f}", "count": int(counts[i])} for i in range(len(counts))]
-                charts.append({
-                    "type": "histogram",
-                    "title": f"{primary_metric['name']} Frequencies",
-                    "data": hist_json,
-                    "x": "range",
-                    "y": "count",
-                    "description": f"Frequency distribution of {primary_metric['name']}."
-                })
-        except:
-            pass
+        # Histogram (bins are filled in by chart_data.py)
+        if primary_metric.get("unique_count", 0) > 1:
+            charts.append({
+                "type": "histogram",
+                "title": f"{primary_metric['name']} Frequencies",
+                "x": "range",
+                "y": "count",
+                "description": f"Frequency distribution of {primary_metric['name']}.",
+                "agg_type": "histogram",
+                "metric": primary_metric['name'],
+                "bins": 10
+            })
 
     # Slot 4: Relationship (Scatter) or Diversity (Radar)
     # Scatter needs 2 continuous metrics
     secondary_metric_opts = [c for c in numeric_cols if c["name"] != primary_metric["name"] and "record count" not in c["name"].lower() and "id" not in c["name"].lower()]
+    # Continuous metrics only (a 0/1 flag or category code on the y-axis
+    # plots a few stripes), unless there are no others
+    continuous_opts = [c for c in secondary_metric_opts
+                       if not c.get("is_categorical", False) and c.get("unique_count", 0) > 2]
+    secondary_metric_opts = continuous_opts or secondary_metric_opts
+    # Most correlated with the primary metric, skipping near-duplicates of it
+    secondary_metric_opts = _rank_by_correlation(secondary_metric_opts, correlation, primary_metric["name"])
+    distinct_opts = [c for c in secondary_metric_opts
+                     if abs(_corr(correlation, c["name"], primary_metric["name"]) or 0.0) < NEAR_DUPLICATE]
+    secondary_metric_opts = distinct_opts or secondary_metric_opts
     secondary_metric = secondary_metric_opts[0] if secondary_metric_opts else None
     
     if secondary_metric:
@@ -353,20 +412,17 @@ def recommend_charts(analysis, df, project_type="general"):
              kpi_metric = alt_metrics[0]
     
     if "record count" not in kpi_metric["name"].lower():
-         total_value = float(df[kpi_metric['name']].sum())
-         avg_value = float(df[kpi_metric['name']].mean())
          kpi_label = kpi_metric['name']
          
-         kpis.append({"label": f"Total {kpi_label}", "value": total_value, "type": "total"})
-         kpis.append({"label": f"Average {kpi_label}", "value": avg_value, "type": "average"})
+         kpis.append(_kpi(f"Total {kpi_label}", "total", kpi_metric['name'], "sum", "float"))
+         kpis.append(_kpi(f"Average {kpi_label}", "average", kpi_metric['name'], "mean", "float"))
          
     # KPI 3: Diversity / Growth (Simple count of categories)
     if major_cat:
-        unique_cats = df[major_cat["name"]].nunique()
-        kpis.append({"label": f"{major_cat['name']} Count", "value": unique_cats, "type": "count"})
+        kpis.append(_kpi(f"{major_cat['name']} Count", "count", major_cat["name"], "nunique", "int"))
 
     return {
         "charts": final_charts[:4],
         "kpis": kpis,
-        "metadata": {"rowCount": row_count}
+        "metadata": _metadata(row_count, correlation)
     }
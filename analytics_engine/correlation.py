@@ -0,0 +1,133 @@
+"""
+Pearson correlations and standard deviations of the numeric columns.
+
+All pairs are computed at once from four matrix products over a chunk of
+rows (counts, sums, sums of squares and cross products of the pairwise
+complete values, as DataFrame.corr() uses). The sums add up across chunks,
+so the chunked CSV profiler and dataset appends keep them as a running
+statistic like any other.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# The matrix grows with the square of the column count: wider frames keep the first ones
+MAX_COLUMNS = 50
+
+# Digits kept in the reported matrix
+DIGITS = 4
+
+
+class CorrelationMoments:
+    """Running pairwise sums for a growing set of numeric columns."""
+
+    def __init__(self, max_columns: int = MAX_COLUMNS):
+        self.max_columns = max_columns
+        self.columns: List[str] = []
+        # Values are shifted by a per-column constant (its first value) so
+        # the sums stay small and the variances do not cancel out
+        self.shift = np.zeros(0)
+        self.n = np.zeros((0, 0))
+        self.sx = np.zeros((0, 0))  # sx[i, j]: sum of column i over rows where j is set too
+        self.sxx = np.zeros((0, 0))
+        self.sxy = np.zeros((0, 0))
+
+    def _add_columns(self, names: List[str]):
+        k, added = len(self.columns), len(names)
+        self.columns.extend(names)
+        self.shift = np.concatenate([self.shift, np.full(added, np.nan)])
+        for name in ("n", "sx", "sxx", "sxy"):
+            grown = np.zeros((k + added, k + added))
+            grown[:k, :k] = getattr(self, name)
+            setattr(self, name, grown)
+
+    def update(self, frame: pd.DataFrame):
+        """Adds the rows of frame (numeric columns only); columns not seen before join the matrix."""
+        new = [c for c in frame.columns if c not in self.columns]
+        new = new[:max(self.max_columns - len(self.columns), 0)]
+        if new:
+            self._add_columns(new)
+        if not self.columns or frame.empty:
+            return
+
+        # Columns missing from this frame are null in all its rows
+        values = frame.reindex(columns=self.columns).to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+        valid = ~np.isnan(values)
+        partial = np.flatnonzero(~valid.all(axis=0))
+        for j in np.flatnonzero(np.isnan(self.shift)):
+            # The shift is the first value seen: any value on the column's scale will do
+            first = np.argmax(valid[:, j])
+            if valid[first, j]:
+                self.shift[j] = values[first, j]
+        values -= np.nan_to_num(self.shift)
+        if len(partial):
+            values[:, partial] = np.where(valid[:, partial], values[:, partial], 0.0)
+
+        # Pairs of columns without nulls only need the column sums and the
+        # Gram matrix; the rest is counted over the rows both have
+        k = len(self.columns)
+        gram = values.T @ values
+        n = np.full((k, k), float(len(values)))
+        sx = np.repeat(values.sum(axis=0)[:, None], k, axis=1)
+        sxx = np.repeat(np.diag(gram)[:, None], k, axis=1)
+        if len(partial):
+            mask = valid[:, partial].astype(np.float64)
+            n[:, partial] = valid.sum(axis=0)[partial]
+            n[np.ix_(partial, partial)] = mask.T @ mask
+            n[partial, :] = n[:, partial].T
+            sx[:, partial] = values.T @ mask
+            sxx[:, partial] = (values * values).T @ mask
+        self.n += n
+        self.sx += sx
+        self.sxx += sxx
+        self.sxy += gram
+
+    def summary(self, columns: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        {"columns", "matrix", "std"} for the given columns (default: all
+        tracked), in that order; None if fewer than two are tracked.
+        Correlations with a constant column are None.
+        """
+        names = [c for c in (self.columns if columns is None else columns) if c in self.columns]
+        if len(names) < 2:
+            return None
+        idx = np.array([self.columns.index(c) for c in names])
+        grid = np.ix_(idx, idx)
+        n, sx, sxx, sxy = self.n[grid], self.sx[grid], self.sxx[grid], self.sxy[grid]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = sxy - sx * sx.T / n
+            var = sxx - sx * sx / n  # var[i, j]: of column i over the rows shared with j
+            matrix = cov / np.sqrt(var * var.T)
+            diagonal = np.diag(var) / (np.diag(n) - 1)
+        # Rounding error can push a perfect correlation just past 1
+        matrix = np.clip(matrix, -1.0, 1.0)
+        matrix[~(var > 1e-12 * np.maximum(sxx, 1.0)) | ~(var.T > 1e-12 * np.maximum(sxx.T, 1.0)) | (n < 2)] = np.nan
+        std = np.sqrt(np.maximum(diagonal, 0.0))
+        return {
+            "columns": names,
+            "matrix": [[_rounded(v) for v in row] for row in matrix],
+            "std": [_rounded(v, None) for v in std],
+        }
+
+
+def _rounded(value, digits: Optional[int] = DIGITS):
+    if not np.isfinite(value):
+        return None
+    return float(value) if digits is None else round(float(value), digits)
+
+
+def correlation_columns(analysis: Dict[str, Any]) -> List[str]:
+    """The columns correlated: numeric ones (not ids), except the virtual Record Count."""
+    from ingest import RECORD_COUNT
+    return [c["name"] for c in analysis["columns"] if c["type"] == "numeric" and c["name"] != RECORD_COUNT]
+
+
+def correlation_summary(df: pd.DataFrame, analysis: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """CorrelationMoments.summary() of the numeric columns of a whole frame."""
+    columns = [c for c in correlation_columns(analysis) if c in df.columns][:MAX_COLUMNS]
+    if len(columns) < 2:
+        return None
+    moments = CorrelationMoments()
+    moments.update(df[columns])
+    return moments.summary()
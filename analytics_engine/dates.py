@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Tuple
+from pandas.tseries.api import guess_datetime_format
+
+# Rows looked at when deciding whether a text column holds dates
+DATE_SAMPLE_SIZE = 200
+
+# Share of sampled rows that must parse for the column to count as a date
+DATE_MIN_RATIO = 0.8
+
+
+def guess_format(col_data: pd.Series) -> Optional[str]:
+    """
+    The strptime format pandas would infer for this column (guessed from the
+    first non-null value), or None when it would fall back to per-element parsing.
+    """
+    not_null = col_data.notna().to_numpy()
+    if not not_null.any():
+        return None
+    value = col_data.iloc[int(not_null.argmax())]
+    return guess_datetime_format(value) if isinstance(value, str) else None
+
+
+def parse_dates(col_data: pd.Series, fmt: Optional[str]) -> pd.Series:
+    """Parses a column with a known format (fast path) or per-element inference."""
+    if fmt:
+        return pd.to_datetime(col_data, format=fmt, errors='coerce')
+    return pd.to_datetime(col_data, errors='coerce')
+
+
+def sample_date_hits(col_data: pd.Series, fmt: Optional[str], size: int = DATE_SAMPLE_SIZE) -> Tuple[int, int]:
+    """
+    Parses an evenly spaced sample of at most `size` rows (nulls included).
+    Returns (rows that parsed, rows sampled).
+    """
+    n = len(col_data)
+    if n == 0:
+        return 0, 0
+    positions = np.unique(np.linspace(0, n - 1, min(n, size)).astype(np.int64))
+    sample = col_data.iloc[positions]
+    try:
+        return int(parse_dates(sample, fmt).notna().sum()), len(sample)
+    except Exception:
+        return 0, len(sample)
+
+
+def detect_date_format(col_data: pd.Series) -> Tuple[bool, Optional[str]]:
+    """
+    Decides from a bounded sample whether a text column holds dates.
+    Returns (is_date, format); free-text columns never get a full-column parse.
+    """
+    fmt = guess_format(col_data)
+    hits, sampled = sample_date_hits(col_data, fmt)
+    return sampled > 0 and hits > sampled * DATE_MIN_RATIO, fmt
+
+
+class DateCache:
+    """
+    Date formats detected while profiling a frame, and the datetime columns
+    parsed from them. analyze_dataframe fills the formats; chart builders call
+    parsed() so every date column is parsed at most once per request.
+    """
+
+    def __init__(self):
+        self.formats: Dict[str, Optional[str]] = {}
+        self._parsed: Dict[str, pd.Series] = {}
+
+    def parsed(self, df: pd.DataFrame, col: str) -> pd.Series:
+        if col not in self._parsed:
+            col_data = df[col]
+            if pd.api.types.is_datetime64_any_dtype(col_data):
+                self._parsed[col] = col_data
+            else:
+                fmt = self.formats[col] if col in self.formats else guess_format(col_data)
+                self._parsed[col] = parse_dates(col_data, fmt)
+        return self._parsed[col]
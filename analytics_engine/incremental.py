@@ -0,0 +1,53 @@
+"""
+Stored state of datasets that grow by appends.
+
+Each dataset is one pickled streaming.ChunkedAnalysis in the state directory.
+Its size depends on the number of columns and groups (category values, days,
+x values), not on the number of rows appended, so loading and saving it does
+not get slower as the history grows.
+"""
+import os
+import pickle
+import re
+
+# Bump when ChunkedAnalysis (or an accumulator) changes shape
+STATE_VERSION = 2
+
+DATASET_ID = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+
+class StateVersionError(Exception):
+    pass
+
+
+def state_path(state_dir: str, dataset_id: str) -> str:
+    return os.path.join(state_dir, f"{dataset_id}.state")
+
+
+def load_state(path: str):
+    """The stored state, or None if the dataset has none yet."""
+    try:
+        with open(path, "rb") as f:
+            version, state = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    if version != STATE_VERSION:
+        raise StateVersionError("Stored dataset state is from an incompatible engine version; delete the dataset and append again")
+    return state
+
+
+def save_state(path: str, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump((STATE_VERSION, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)  # atomic, so readers never see a partial file
+
+
+def delete_state(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
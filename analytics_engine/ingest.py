@@ -0,0 +1,228 @@
+import json
+import re
+import numpy as np
+import pandas as pd
+from typing import Any, Collection, Dict, Iterator, List, Tuple
+
+# Content types accepted by POST /analyze
+JSON_CONTENT_TYPE = "application/json"
+ARROW_STREAM_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+
+# Standard count metric (1 per row). Unless the data has a column of that name
+# it is virtual: group sums of it are group sizes and nothing is stored.
+RECORD_COUNT = "Record Count"
+
+# JSON whitespace, skipped between tokens when decoding in chunks
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Smallest integer dtypes tried when downcasting, in order
+_INT_DTYPES = [np.int8, np.int16, np.int32]
+
+
+def make_unique_columns(cols: List[str]) -> List[str]:
+    """
+    Make column names unique while preserving order.
+    If duplicates exist after stripping whitespace, suffix with _2, _3, ...
+    """
+    seen: Dict[str, int] = {}
+    out: List[str] = []
+    for c in cols:
+        base = str(c).strip()
+        n = seen.get(base, 0) + 1
+        seen[base] = n
+        out.append(base if n == 1 else f"{base}_{n}")
+    return out
+
+
+class IngestError(ValueError):
+    """Raised when a request body cannot be turned into a DataFrame."""
+
+
+class NotChunkable(IngestError):
+    """Raised when a request body can only be decoded whole, not in chunks."""
+
+
+def frame_from_rows(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Row-oriented payload: [{col: value, ...}, ...] (the original format).
+    """
+    return pd.DataFrame(rows)
+
+
+def frame_from_columns(columns: Any) -> pd.DataFrame:
+    """
+    Column-oriented payload: {name: [values]}.
+    Each list becomes one column directly, so there is no per-row dict to
+    validate or pivot.
+    """
+    if not isinstance(columns, dict):
+        raise IngestError("'columns' must be an object mapping column name to a list of values")
+
+    lengths = set()
+    for name, values in columns.items():
+        if not isinstance(values, list):
+            raise IngestError(f"Column '{name}' must be a list of values")
+        lengths.add(len(values))
+
+    if len(lengths) > 1:
+        raise IngestError("All columns must have the same number of values")
+
+    return pd.DataFrame(columns)
+
+
+def iter_row_chunks(body: bytes, chunk_size: int, fields: Dict[str, Any]) -> Iterator[pd.DataFrame]:
+    """
+    The "data" rows of a row-oriented JSON body, chunk_size rows per frame,
+    decoded one row at a time so only one chunk of row dicts exists at once.
+    The body's other top-level fields (projectType) are stored in fields. A
+    column-oriented body raises IngestError: it can only be decoded whole.
+    """
+    text = ""
+    decoder = json.JSONDecoder()
+
+    def skip(i: int) -> int:
+        return _WHITESPACE.match(text, i).end()
+
+    def expect(i: int, chars: str) -> int:
+        i = skip(i)
+        if i >= len(text) or text[i] not in chars:
+            raise ValueError(f"expected one of {chars!r} at offset {i}")
+        return i
+
+    try:
+        text = body.decode("utf-8-sig")
+        i = expect(0, "{") + 1
+        if text[skip(i)] == "}":
+            return
+        while True:
+            key, i = decoder.raw_decode(text, expect(i, '"'))
+            i = skip(expect(i, ":") + 1)
+            if key == "columns":
+                raise NotChunkable("Column-oriented bodies can not be decoded in chunks")
+            if key != "data":
+                fields[key], i = decoder.raw_decode(text, i)
+            else:
+                i = expect(i, "[") + 1
+                rows: List[Dict[str, Any]] = []
+                if text[skip(i)] == "]":
+                    i = skip(i) + 1
+                else:
+                    while True:
+                        row, i = decoder.raw_decode(text, skip(i))
+                        if not isinstance(row, dict):
+                            raise IngestError("'data' must be a list of objects")
+                        rows.append(row)
+                        if len(rows) == chunk_size:
+                            yield frame_from_rows(rows)
+                            rows = []
+                        i = expect(i, ",]")
+                        i += 1
+                        if text[i - 1] == "]":
+                            break
+                if rows:
+                    yield frame_from_rows(rows)
+            i = expect(i, ",}") + 1
+            if text[i - 1] == "}":
+                return
+    except (ValueError, IndexError) as e:
+        if isinstance(e, IngestError):
+            raise
+        raise IngestError(f"Request body is not valid JSON: {e}")
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise IngestError("Arrow payloads require the 'pyarrow' package")
+    return pa
+
+
+def arrow_row_count(body: bytes) -> int:
+    """Rows of an Arrow IPC stream, from its batch headers (the buffers are not copied)."""
+    pa = _pyarrow()
+    try:
+        with pa.ipc.open_stream(pa.py_buffer(body)) as reader:
+            return sum(batch.num_rows for batch in reader)
+    except pa.ArrowInvalid as e:
+        raise IngestError(f"Invalid Arrow IPC stream: {e}")
+
+
+def iter_arrow_chunks(body: bytes, chunk_size: int, metadata: Dict[str, str]) -> Iterator[pd.DataFrame]:
+    """
+    An Arrow IPC stream as frames of chunk_size rows (batches are sliced, not
+    copied). The schema's key/value metadata is stored in metadata.
+    """
+    pa = _pyarrow()
+    try:
+        with pa.ipc.open_stream(pa.py_buffer(body)) as reader:
+            metadata.update({k.decode("utf-8"): v.decode("utf-8") for k, v in (reader.schema.metadata or {}).items()})
+            pieces, rows = [], 0
+            for batch in reader:
+                offset = 0
+                while offset < batch.num_rows:
+                    piece = batch.slice(offset, chunk_size - rows)
+                    pieces.append(piece)
+                    rows += piece.num_rows
+                    offset += piece.num_rows
+                    if rows == chunk_size:
+                        yield pa.Table.from_batches(pieces).to_pandas(split_blocks=True)
+                        pieces, rows = [], 0
+            if pieces:
+                yield pa.Table.from_batches(pieces).to_pandas(split_blocks=True)
+    except pa.ArrowInvalid as e:
+        raise IngestError(f"Invalid Arrow IPC stream: {e}")
+
+
+def frame_from_arrow_stream(body: bytes) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """
+    Apache Arrow IPC stream payload.
+    Returns the DataFrame plus the schema's key/value metadata (which may carry
+    "projectType"). Numeric columns without nulls are handed to pandas without
+    copying; split_blocks/self_destruct avoid consolidating into one block.
+    """
+    pa = _pyarrow()
+    try:
+        with pa.ipc.open_stream(pa.py_buffer(body)) as reader:
+            table = reader.read_all()
+    except pa.ArrowInvalid as e:
+        raise IngestError(f"Invalid Arrow IPC stream: {e}")
+
+    metadata = {k.decode("utf-8"): v.decode("utf-8") for k, v in (table.schema.metadata or {}).items()}
+    return table.to_pandas(split_blocks=True, self_destruct=True), metadata
+
+
+def compact_frame(df: pd.DataFrame, analysis: Dict[str, Any], summed: Collection[str] = ()) -> pd.DataFrame:
+    """
+    Shrinks a profiled frame in place, using the statistics in analysis:
+    - integer metrics are downcast to the smallest dtype holding their min/max
+    - string columns flagged is_categorical become pandas categoricals, unless
+      they are in summed (columns a chart or KPI sums or averages, see
+      chart_data.summed_columns): those become numbers if every value parses
+      as one (numbers posted as text), and stay as they are otherwise
+    Values are unchanged (floats keep float64 so sums and means do not move).
+    """
+    info = {c["name"]: c for c in analysis["columns"]}
+    for col in df.columns:
+        col_info = info.get(col)
+        if col_info is None:
+            continue
+        col_data = df[col]
+        if col_info["type"] == "numeric" and pd.api.types.is_signed_integer_dtype(col_data) \
+                and isinstance(col_data.dtype, np.dtype):
+            low, high = col_info["min"], col_info["max"]
+            for dtype in _INT_DTYPES:
+                limits = np.iinfo(dtype)
+                if col_data.dtype.itemsize > limits.bits // 8 and limits.min <= low and high <= limits.max:
+                    df[col] = col_data.astype(dtype)
+                    break
+        elif col in summed:
+            if col_info["type"] == "string" and not pd.api.types.is_numeric_dtype(col_data):
+                try:
+                    df[col] = pd.to_numeric(col_data)
+                except (ValueError, TypeError):
+                    pass
+        elif col_info["type"] == "string" and col_info["is_categorical"] \
+                and not isinstance(col_data.dtype, pd.CategoricalDtype):
+            df[col] = col_data.astype("category")
+    return df
@@ -0,0 +1,43 @@
+import json
+import logging
+import os
+import sys
+import time
+
+LOGGER_NAME = "analytics_engine"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line. Structured values go in extra={"fields": {...}}
+    and are merged into the object.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    """
+    Engine logs go to stderr as JSON lines at LOG_LEVEL (default INFO).
+    DEBUG adds the per-request DataFrame and analysis dumps.
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.handlers = [handler]
+    logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
@@ -1,222 +1,607 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Any
-import pandas as pd
+import time
+_import_start = time.perf_counter()
+
+from fastapi import FastAPI, File, Form, HTTPException, Request, Response, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+import asyncio
+import gc
+import hmac
+from typing import Dict, Any, Mapping, Optional, Tuple
 import io
-from analyzer import analyze_dataframe
-from chart_recommender import recommend_charts
-import sys
-app = FastAPI(title="AnalyticsForge Engine 🧠")
+import json
+import os
+import tempfile
+from cache import ResultCache, dataset_key
+from incremental import DATASET_ID, delete_state, state_path
+from ingest import ARROW_STREAM_CONTENT_TYPE
+from logs import configure_logging, get_logger
+from metrics import Timings, observe_analysis, observe_request, registry
+from partitioned import DEFAULT_MIN_ROWS, configure_partitions
+from profiling import run_profiled
+from pipeline import (
+    analyze_body,
+    analyze_csv_file,
+    analyze_registered,
+    append_rows,
+    dataset_result,
+    parse_flag,
+    parse_int,
+    register_body,
+)
+from query import run_query
+from registry import dataset_info, dataset_path, delete_dataset as delete_registered
+from sampling import DEFAULT_SEED
+from serialize import LAYOUTS, compress, encode_result
+from streaming import DEFAULT_CHUNK_SIZE
+from warmup import warm_up
+from workers import JobTimeout, PoolSaturated, WorkerPool
 
-class DataPayload(BaseModel):
-    data: List[Dict[str, Any]]
-    projectType: str = "general"
+configure_logging()
+logger = get_logger("server")
 
-def _make_unique_columns(cols: List[str]) -> List[str]:
-    """
-    Make column names unique while preserving order.
-    If duplicates exist after stripping whitespace, suffix with _2, _3, ...
-    """
-    seen: Dict[str, int] = {}
-    out: List[str] = []
-    for c in cols:
-        base = str(c).strip()
-        n = seen.get(base, 0) + 1
-        seen[base] = n
-        out.append(base if n == 1 else f"{base}_{n}")
-    return out
+# Part of every cache key: bump whenever a change alters /analyze output
+ENGINE_VERSION = "1.4.0"
+
+# Serialized results of repeated analyses of the same dataset.
+# ANALYZE_CACHE_DIR enables the on-disk tier (kept across restarts).
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get("ANALYZE_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+    disk_dir=os.environ.get("ANALYZE_CACHE_DIR") or None,
+    disk_max_bytes=int(os.environ.get("ANALYZE_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024)),
+)
+
+# Mergeable state of datasets that grow through /datasets/{id}/append
+STATE_DIR = os.environ.get("ANALYZE_STATE_DIR") or os.path.join(tempfile.gettempdir(), "analytics_engine_state")
+
+# Datasets registered with POST /datasets (Arrow files, memory-mapped by analyses)
+REGISTRY_DIR = os.environ.get("ANALYZE_REGISTRY_DIR") or os.path.join(tempfile.gettempdir(), "analytics_engine_datasets")
+
+# Registered datasets each worker keeps loaded (with their indexes, profile and
+# rollup cube) for /query and /analyze?datasetId=
+QUERY_DATASETS = int(os.environ.get("ANALYZE_QUERY_DATASETS", 4))
+
+# Memory one request may take to analyze, in MB. Bodies are estimated before
+# any frame is built (see admission.py): over the budget, /analyze runs in
+# streaming mode or answers 413, and so do bodies that alone exceed it
+# (checked from Content-Length before they are read).
+MEMORY_BUDGET = int(float(os.environ.get("ANALYZE_MEMORY_BUDGET_MB", 2048)) * 1024 * 1024)
+
+# /analyze?profile=true (see profiling.py) is only served to requests whose
+# X-Profile-Token header matches ANALYZE_PROFILE_TOKEN; without it, never.
+PROFILE_TOKEN = os.environ.get("ANALYZE_PROFILE_TOKEN") or None
+
+# Frames of at least ANALYZE_PARTITION_ROWS rows run their groupings and
+# histograms in partitions on ANALYZE_PARTITION_THREADS threads per worker
+# (see partitioned.py); ANALYZE_PARTITION_THREADS=1 keeps them on one thread.
+configure_partitions(
+    threads=int(os.environ.get("ANALYZE_PARTITION_THREADS", os.cpu_count() or 1)),
+    min_rows=int(os.environ.get("ANALYZE_PARTITION_ROWS", DEFAULT_MIN_ROWS)),
+)
+
+# Appends to one dataset run one at a time (each reads and rewrites its state)
+dataset_locks: Dict[str, asyncio.Lock] = {}
+
+# Analyses run in worker processes so the event loop keeps serving requests.
+# ANALYZE_WORKERS=0 runs them inline instead.
+def make_worker_pool() -> WorkerPool:
+    return WorkerPool(
+        workers=int(os.environ.get("ANALYZE_WORKERS", os.cpu_count() or 1)),
+        queue_size=int(os.environ.get("ANALYZE_QUEUE_SIZE", 16)),
+        timeout=float(os.environ.get("ANALYZE_JOB_TIMEOUT", 300)),
+    )
+
+worker_pool = make_worker_pool()
+
+# ANALYZE_WARM_UP=0 skips the warm-up run (the workers are still started before ready)
+WARM_UP = parse_flag(os.environ.get("ANALYZE_WARM_UP", "true"))
+
+# Cold start of this process in ms (from the import of this module), reported by /ready
+startup: Dict[str, Optional[float]] = {
+    "importMs": None, "warmUpMs": None, "workersStartMs": None, "readyMs": None, "firstRequestMs": None,
+}
+
+# Set once warm-up is done and the workers run; analyses wait for it
+ready: Optional[asyncio.Event] = None
+
+def _ms_since(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 3)
+
+async def _start_engine():
+    start = time.perf_counter()
+    if WARM_UP:
+        try:
+            # In a thread, so / and /ready keep answering meanwhile
+            await asyncio.to_thread(warm_up)
+        except Exception:
+            logger.exception("warm-up failed")
+    startup["warmUpMs"] = _ms_since(start)
+
+    start = time.perf_counter()
+    if worker_pool.workers:
+        # Keep the collector from writing to the objects the forked workers share
+        gc.freeze()
+        try:
+            await worker_pool.start(warm_up if WARM_UP else os.getpid)
+        except Exception:
+            logger.exception("starting the worker processes failed")
+    startup["workersStartMs"] = _ms_since(start)
+    startup["readyMs"] = _ms_since(_import_start)
+    ready.set()
+    logger.info("engine ready", extra={"fields": {"workers": worker_pool.workers, **startup}})
+
+async def _wait_ready():
+    # No worker is forked from a parent that is still warming up
+    if ready is not None and not ready.is_set():
+        await ready.wait()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global ready
+    ready = asyncio.Event()
+    starting = asyncio.create_task(_start_engine())
+    yield
+    starting.cancel()
+    worker_pool.shutdown()
+
+app = FastAPI(title="AnalyticsForge Engine 🧠", version=ENGINE_VERSION, lifespan=lifespan)
+
+# Cache and worker pool state, read when /metrics is scraped
+registry.collectors.append(lambda: {
+    "analytics_cache_hits_total": ("counter", "Result cache hits (memory and disk).", result_cache.hits + result_cache.disk_hits),
+    "analytics_cache_misses_total": ("counter", "Result cache misses.", result_cache.misses),
+    "analytics_cache_bytes": ("gauge", "Bytes held by the in-memory result cache.", result_cache.stats()["bytes"]),
+    "analytics_workers_running": ("gauge", "Analyses running in worker processes.", worker_pool.running),
+    "analytics_workers_waiting": ("gauge", "Analyses waiting for a free worker.", worker_pool.waiting),
+    "analytics_workers_rejected_total": ("counter", "Analyses rejected with 429.", worker_pool.rejected),
+    "analytics_workers_timed_out_total": ("counter", "Analyses killed after the job timeout.", worker_pool.timed_out),
+    "analytics_ready": ("gauge", "1 once warm-up is done and the workers run.", int(ready is not None and ready.is_set())),
+})
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    # Latency and status of every analysis endpoint (cache hits and errors included)
+    path = request.url.path
+    if path.startswith("/datasets/") and path.endswith("/append"):
+        endpoint = "/datasets/append"  # one series for all dataset ids
+    elif path.startswith("/analyze") or path in ("/datasets", "/query"):
+        endpoint = path
+    else:
+        return await call_next(request)
+    start = time.perf_counter()
+    response = await call_next(request)
+    observe_request(endpoint, response.status_code, time.perf_counter() - start)
+    return response
 
 @app.get("/")
 async def root():
     return {"message": "Analytics Engine is online"}
 
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: 503 until warm-up is done and the workers run, then 200. Both report the cold start timings."""
+    if ready is None or not ready.is_set():
+        return JSONResponse(status_code=503, content={"status": "starting", "startup": startup})
+    return {"status": "ready", "startup": startup}
+
+def _content_type(request: Request) -> str:
+    return request.headers.get("content-type", "").split(";")[0].strip().lower()
+
+def _output_options(params: Mapping[str, str]) -> Tuple[str, Optional[int]]:
+    """
+    Response shape of the analysis endpoints: ?layout=records|columns (chart
+    data as one record per point, or one list per column) and ?precision=N
+    (floats rounded to N significant digits).
+    """
+    layout = params.get("layout") or "records"
+    if layout not in LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"layout must be one of: {', '.join(LAYOUTS)}")
+    return layout, parse_int(params, "precision", None, 1)
+
+def _json_response(request: Request, body: bytes, cache: Optional[str] = None) -> Response:
+    """Encoded JSON, compressed if the client accepts it."""
+    headers = {"Vary": "Accept-Encoding"}
+    if cache:
+        headers["X-Cache"] = cache
+    body, encoding = compress(body, request.headers.get("accept-encoding", ""))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _encode(request: Request, result: Dict[str, Any], timings: Timings) -> bytes:
+    with timings.stage("serialize"):
+        return encode_result(result, *_output_options(request.query_params))
+
+def _cached_response(request: Request, key: str):
+    body = result_cache.get(key)
+    if body is None:
+        return None
+    return _json_response(request, body, "HIT")
+
+def _cache_response(request: Request, key: str, result: Dict[str, Any], timings: Timings) -> Response:
+    # Kept encoded (uncompressed) for later hits
+    body = _encode(request, result, timings)
+    result_cache.put(key, body)
+    with timings.stage("compress"):
+        return _json_response(request, body, "MISS")
+
+def _record_analysis(endpoint: str, result: Dict[str, Any], timings: Timings, start: float,
+                     rows: Optional[int] = None):
+    """rows: rows processed, if not the whole dataset (appends)."""
+    seconds = time.perf_counter() - start
+    analysis = result["analysis"]
+    rows, columns = rows if rows is not None else analysis["row_count"], len(analysis["columns"])
+    observe_analysis(endpoint, timings, rows, columns, seconds)
+    if startup["firstRequestMs"] is None:
+        startup["firstRequestMs"] = round(seconds * 1000, 3)
+    logger.info("analysis finished", extra={"fields": {
+        "endpoint": endpoint,
+        "projectType": result["projectType"],
+        "rows": rows,
+        "columns": columns,
+        "durationMs": round(seconds * 1000, 3),
+        "stagesMs": timings.as_ms(),
+    }})
+
+def _analyze_key(body: bytes, content_type: str, params: Mapping[str, str]) -> str:
+    # Identical body + parameters + engine version (+ the budget deciding on streaming mode) -> identical result
+    return dataset_key([body], content_type, params.get("projectType"), parse_flag(params.get("approximate", "")),
+                       params.get("sampleSize"), params.get("sampleSeed"), *_output_options(params), ENGINE_VERSION,
+                       MEMORY_BUDGET)
+
+async def _read_body(request: Request) -> bytes:
+    """The request body; 413 without reading it if its Content-Length alone exceeds the memory budget."""
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > MEMORY_BUDGET:
+        raise HTTPException(status_code=413, detail=f"Payload of {int(length) / 2 ** 20:.0f} MB exceeds the engine's "
+                                                    f"memory budget of {MEMORY_BUDGET / 2 ** 20:.0f} MB per request")
+    return await request.body()
+
+def _profile_requested(request: Request) -> bool:
+    """?profile=true, checked against the profile token (403 if it is not allowed)."""
+    if not parse_flag(request.query_params.get("profile", "")):
+        return False
+    if PROFILE_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Profiling is disabled on this engine")
+    token = request.headers.get("x-profile-token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), PROFILE_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Profiling requires a valid X-Profile-Token header")
+    return True
+
+async def _run_job(fn, *args) -> Dict[str, Any]:
+    await _wait_ready()
+    try:
+        return await worker_pool.run(fn, *args)
+    except PoolSaturated:
+        raise HTTPException(status_code=429, detail="Engine is busy, retry later", headers={"Retry-After": "1"})
+    except JobTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except BrokenProcessPool:
+        raise HTTPException(status_code=500, detail="Python Engine Error: worker process died")
+
 @app.post("/analyze")
-async def analyze(payload: DataPayload):
+async def analyze(request: Request):
+    """
+    Analyzes the dataset in the request body, or with ?datasetId= a dataset
+    registered with POST /datasets (the body is then ignored).
+    A body over the memory budget is analyzed in streaming mode (flagged in
+    metadata["admission"]) or rejected with 413, see pipeline.analyze_body.
+    ?profile=true (with the X-Profile-Token header) adds a profile of the
+    analysis as metadata["profile"], see profiling.py.
+    """
+    start = time.perf_counter()
+    profile = _profile_requested(request)
+    dataset_id = request.query_params.get("datasetId")
+    if dataset_id is not None:
+        return await _analyze_registered(request, dataset_id, start, profile)
+    content_type = _content_type(request)
+    ingest = Timings()
+    with ingest.stage("ingest"):
+        body = await _read_body(request)
+
+    job = (analyze_body, body, content_type, dict(request.query_params), MEMORY_BUDGET)
+    if profile:
+        return await _analyze_profiled(request, job, start, ingest)
+    key = _analyze_key(body, content_type, request.query_params)
+    cached = _cached_response(request, key)
+    if cached is not None:
+        return cached
+
+    result, timings = await _run_job(*job)
+    timings.stages = {**ingest.stages, **timings.stages}
+    response = _cache_response(request, key, result, timings)
+    _record_analysis("/analyze", result, timings, start)
+    return response
+
+async def _analyze_registered(request: Request, dataset_id: str, start: float, profile: bool = False):
+    path = _registered_path(dataset_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Unknown dataset")
+    job = (analyze_registered, path, dict(request.query_params), QUERY_DATASETS)
+    if profile:
+        return await _analyze_profiled(request, job, start)
+    # Dataset ids are content hashes, so the id stands for the dataset bytes
+    key = _analyze_key(dataset_id.encode("utf-8"), "registered", request.query_params)
+    cached = _cached_response(request, key)
+    if cached is not None:
+        return cached
+
+    result, timings = await _run_job(*job)
+    response = _cache_response(request, key, result, timings)
+    _record_analysis("/analyze", result, timings, start)
+    return response
+
+async def _analyze_profiled(request: Request, job: tuple, start: float, ingest: Optional[Timings] = None):
+    # Always run (a cached result has no profile) and never cached
+    result, timings = await _run_job(run_profiled, *job)
+    if ingest is not None:
+        timings.stages = {**ingest.stages, **timings.stages}
+    response = _json_response(request, _encode(request, result, timings))
+    _record_analysis("/analyze", result, timings, start)
+    return response
+
+def _batch_line(index: int, status: int, result: Optional[bytes] = None, cache: Optional[str] = None,
+                detail: Any = None) -> bytes:
+    if result is not None:
+        # The result is already-encoded JSON (as cached): spliced in, not re-encoded
+        return b'{"index":%d,"status":%d,"cache":"%s","result":' % (index, status, cache.encode()) + result + b"}\n"
+    return json.dumps({"index": index, "status": status, "detail": detail}).encode("utf-8") + b"\n"
+
+@app.post("/analyze/batch")
+async def analyze_batch(request: Request):
+    """
+    Analyzes several datasets in one call. The body is NDJSON: one /analyze
+    JSON body per line ({"data": [...]} or {"columns": {...}}, each with its
+    own projectType); query parameters apply to every item.
+
+    Items run in parallel on the worker pool (one per worker) and the response
+    streams one NDJSON line per item as it finishes, in completion order:
+    {"index": i, "status": 200, "cache": "HIT" | "MISS", "result": {...}} or
+    {"index": i, "status": 4xx/5xx, "detail": ...}; a failed item does not stop
+    the others. The last line is {"done": true, "items": n, "failed": k}.
+    """
+    body = await _read_body(request)
+    lines = [line for line in body.split(b"\n") if line.strip()]
+    if not lines:
+        raise HTTPException(status_code=400, detail="Empty batch: send one JSON dataset per line")
+    params = dict(request.query_params)
+    _output_options(params)  # 400 before streaming starts
+    # Leave the pool's queue to other requests: a batch never waits on more than one slot per worker
+    concurrency = asyncio.Semaphore(max(worker_pool.workers, 1))
+
+    async def run_item(index: int, line: bytes) -> Tuple[bool, bytes]:
+        start = time.perf_counter()
+        key = _analyze_key(line, "application/json", params)
+        cached = result_cache.get(key)
+        if cached is not None:
+            return True, _batch_line(index, 200, cached, "HIT")
+        try:
+            async with concurrency:
+                result, timings = await _run_job(analyze_body, line, "application/json", params, MEMORY_BUDGET)
+        except HTTPException as e:
+            return False, _batch_line(index, e.status_code, detail=e.detail)
+        except RequestValidationError as e:
+            return False, _batch_line(index, 422, detail=jsonable_encoder(e.errors()))
+        try:
+            encoded = _encode(request, result, timings)
+        except (TypeError, ValueError) as e:
+            # e.g. a NaN left in the result; fail this item, not the stream
+            logger.exception("batch item could not be serialized")
+            return False, _batch_line(index, 500, detail=f"Python Engine Error: {e}")
+        result_cache.put(key, encoded)
+        _record_analysis("/analyze/batch", result, timings, start)
+        return True, _batch_line(index, 200, encoded, "MISS")
+
+    async def stream():
+        tasks = [asyncio.ensure_future(run_item(i, line)) for i, line in enumerate(lines)]
+        failed = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                ok, line = await finished
+                failed += not ok
+                yield line
+        finally:
+            # The client went away: drop the items that have not started
+            for task in tasks:
+                task.cancel()
+        yield json.dumps({"done": True, "items": len(lines), "failed": failed}).encode("utf-8") + b"\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/analyze/csv")
+async def analyze_csv(
+    request: Request,
+    file: UploadFile = File(...),
+    projectType: str = Form("general"),
+    chunkSize: int = Form(DEFAULT_CHUNK_SIZE),
+    approximate: bool = Form(False),
+    sampleSize: Optional[int] = Form(None),
+    sampleSeed: int = Form(DEFAULT_SEED),
+):
+    """
+    Streaming mode for large CSV uploads: the file is spooled to disk by the
+    multipart parser and analyzed in chunks of chunkSize rows, so memory is
+    bounded by the chunk size instead of the file size. With approximate=true
+    distinct counts and box plot quartiles are merged from per-chunk sketches.
+    """
+    if chunkSize <= 0:
+        raise HTTPException(status_code=400, detail="chunkSize must be a positive integer")
+    if sampleSize is not None and sampleSize <= 0:
+        raise HTTPException(status_code=400, detail="sampleSize must be a positive integer")
+    if sampleSeed < 0:
+        raise HTTPException(status_code=400, detail="sampleSeed must be at least 0")
+
+    start = time.perf_counter()
+    ingest = Timings()
+
+    # The worker reads the upload from a file of its own; hash it while copying
+    file.file.seek(0)
+    with ingest.stage("ingest"), tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as upload:
+        def copy_blocks():
+            for block in iter(lambda: file.file.read(1024 * 1024), b""):
+                upload.write(block)
+                yield block
+        key = dataset_key(copy_blocks(), "text/csv", projectType, chunkSize, approximate,
+                          sampleSize, sampleSeed, *_output_options(request.query_params), ENGINE_VERSION)
+
     try:
-        if not payload.data:
-            raise HTTPException(status_code=400, detail="Empty data provided")
-            
-        # Convert list of dicts to DataFrame
-        # Convert list of dicts to DataFrame
-        df = pd.DataFrame(payload.data)
-        # Normalize column names (common cause of "same column" bugs).
-        df.columns = _make_unique_columns([str(c) for c in df.columns])
-        
-        # Inject standard virtual metric for counting
-        if "Record Count" not in df.columns:
-            df["Record Count"] = 1
-            
-        # LOGGING
-        print(f"DEBUG: DataFrame shape: {df.shape}", file=sys.stderr)
-        print(f"DEBUG: DataFrame columns: {df.columns.tolist()}", file=sys.stderr)
-        print(f"DEBUG: DataFrame dtypes:\n{df.dtypes}", file=sys.stderr)
-
-        # Analyze data types and structure
-        analysis = analyze_dataframe(df)
-        print(f"DEBUG: Analysis Result: {analysis}", file=sys.stderr)
-        
-        # Get chart recommendations
-        recommendations = recommend_charts(analysis, df, payload.projectType)
-        
-        # Format the processed data for charts (aggregated if necessary, or just sampled)
-        # For simplicity, we'll return the original data and the logic to render
-        # But for large datasets, we should aggregate here.
-        # Let's add a basic aggregation for categorical charts
-        
-        for chart in recommendations["charts"]:
-            agg_type = chart.get("agg_type")
-            
-            if agg_type == "radar_mean" or agg_type == "multi_bar_mean":
-                # Multi-variable comparison (Radar/Bar)
-                # Group by Failure (0/1) -> Mean of Metrics -> Transpose
-                group_col = chart.get("group_col")
-                metrics = chart.get("metrics")
-                
-                if group_col and metrics:
-                    # Calculate means
-                    grouped = df.groupby(group_col)[metrics].mean().reset_index()
-                    
-                    # Melt/Transpose to get: [{ subject: "Temp", "0": 300, "1": 400 }]
-                    # Easier: Just iterate metrics and build the list
-                    data = []
-                    for metric in metrics:
-                        row = {chart.get("x"): metric} # x axis name (subject/metric)
-                        for _, group_row in grouped.iterrows():
-                            # group_row[group_col] is 0 or 1
-                            key = str(int(group_row[group_col])) if pd.notna(group_row[group_col]) else "Unknown"
-                            row[key] = group_row[metric]
-                        data.append(row)
-                    
-                    chart["data"] = data
-            
-            elif agg_type == "scatter_group":
-                # Scatter with grouping
-                # We need to split data into series
-                x_col = chart["x"]
-                y_col = chart["y"]
-                group_col = chart.get("group_col")
-                
-                if group_col:
-                    # Sample first
-                    sample_df = df.sample(min(300, len(df)))
-                    
-                    # Update series data
-                    for series in chart["series"]:
-                        # series["dataKey"] holds the group value ("0" or "1")
-                        group_val = int(series["dataKey"])
-                        series_data = sample_df[sample_df[group_col] == group_val][[x_col, y_col]].to_dict(orient="records")
-                        series["data"] = series_data
-            
-            elif chart["type"] in ["bar", "pie", "treemap"]:
-                x_col = chart.get("x") or chart.get("nameKey")
-                y_col = chart.get("y") or chart.get("dataKey")
-                
-                if x_col and y_col:
-                    # Group by category and sum numeric
-                    agg_func = "mean" if chart.get("agg_type") == "mean" else "sum"
-                    
-                    if x_col == y_col:
-                         # Collision avoidance: Grouping by X and Summing X
-                         # Rename the value column to avoid conflict with index
-                         if agg_func == "mean":
-                            agg_df = df.groupby(x_col)[y_col].mean().reset_index(name="value")
-                         else:
-                            agg_df = df.groupby(x_col)[y_col].sum().reset_index(name="value")
-                         chart["y"] = "value" # Update chart config to read from new column
-                    else:
-                        if agg_func == "mean":
-                            agg_df = df.groupby(x_col)[y_col].mean().reset_index()
-                        else:
-                            agg_df = df.groupby(x_col)[y_col].sum().reset_index()
-                    
-                    agg_df = agg_df.sort_values(by=chart["y"], ascending=False).head(10) # Top 10
-                    chart["data"] = agg_df.to_dict(orient="records")
-            
-            elif chart["type"] in ["line", "area"]:
-                x_col = chart["x"]
-                y_col = chart["y"]
-                # If X is numeric (e.g. training_hours), use simple X-Y aggregation instead of date parsing.
-                # Numeric columns parsed as dates produce "Jan 1970" and collapse to one point.
-                if x_col in df.columns and pd.api.types.is_numeric_dtype(df[x_col]):
-                    agg_df = df.groupby(x_col)[y_col].mean().reset_index()
-                    agg_df = agg_df.sort_values(by=x_col).head(50)
-                    chart["data"] = agg_df.to_dict(orient="records")
-                else:
-                    # Sort by date
-                    df_copy = df.copy()
-                    df_copy[x_col] = pd.to_datetime(df_copy[x_col], errors='coerce')
-                    df_sorted = df_copy.dropna(subset=[x_col]).sort_values(by=x_col)
-                    if df_sorted.empty:
-                        chart["data"] = []
-                    else:
-                        df_sorted = df_sorted.copy()
-                        df_sorted['display_date'] = df_sorted[x_col].dt.strftime('%b %Y')
-                        agg_df = df_sorted.groupby('display_date')[y_col].sum().reset_index()
-                        agg_df['sort_key'] = pd.to_datetime(agg_df['display_date'])
-                        agg_df = agg_df.sort_values(by='sort_key')
-                        chart["data"] = agg_df[['display_date', y_col]].rename(columns={'display_date': x_col}).to_dict(orient="records")
-            
-            elif chart["type"] == "scatter":
-                x_col = chart["x"]
-                y_col = chart["y"]
-                # Sample 100 points if dataset is large
-                sample_size = min(100, len(df))
-                chart["data"] = df[[x_col, y_col]].sample(sample_size).to_dict(orient="records")
-            
-            elif chart["type"] == "boxPlot":
-                x_col = chart.get("x")
-                y_col = chart.get("y")
-                if x_col and y_col and x_col in df.columns and y_col in df.columns:
-                    tmp = df[[x_col, y_col]].copy()
-                    tmp[y_col] = pd.to_numeric(tmp[y_col], errors="coerce")
-                    tmp = tmp.dropna(subset=[x_col, y_col])
-                    if not tmp.empty:
-                        grouped = (
-                            tmp.groupby(x_col)[y_col]
-                            .agg(
-                                min="min",
-                                q1=lambda s: s.quantile(0.25),
-                                median="median",
-                                q3=lambda s: s.quantile(0.75),
-                                max="max",
-                                count="count",
-                            )
-                            .reset_index()
-                        )
-
-                        # Prefer more-representative categories when there are many.
-                        grouped = grouped.sort_values(by="count", ascending=False).head(20)
-
-                        # Frontend expects x-axis key "category"
-                        grouped = grouped.rename(columns={x_col: "category"}).drop(columns=["count"])
-
-                        # Ensure JSON-serializable plain Python numbers
-                        for c in ["min", "q1", "median", "q3", "max"]:
-                            grouped[c] = grouped[c].astype(float)
-
-                        chart["data"] = grouped.to_dict(orient="records")
-
-        return {
-            "status": "success",
-            "projectType": payload.projectType,
-            "analysis": analysis,
-            "charts": recommendations["charts"],
-            "kpis": recommendations["kpis"],
-            "metadata": recommendations["metadata"]
-        }
-        
-    except Exception as e:
-        import traceback
-        
-        # Enhanced Logging
-        print("======== PYTHON ENGINE CRASH ========", file=sys.stderr)
-        traceback.print_exc()
-        print(f"Error Message: {str(e)}", file=sys.stderr)
-        print("=====================================", file=sys.stderr)
-        
-        raise HTTPException(status_code=500, detail=f"Python Engine Error: {str(e)}")
+        cached = _cached_response(request, key)
+        if cached is not None:
+            return cached
+        result, timings = await _run_job(analyze_csv_file, upload.name, projectType, chunkSize,
+                                         approximate, sampleSize, sampleSeed)
+        timings.stages = {**ingest.stages, **timings.stages}
+        response = _cache_response(request, key, result, timings)
+        _record_analysis("/analyze/csv", result, timings, start)
+        return response
+    finally:
+        os.remove(upload.name)
+
+def _check_dataset_id(dataset_id: str):
+    if not DATASET_ID.match(dataset_id):
+        raise HTTPException(status_code=400, detail="Dataset id may only contain letters, digits, '.', '_' and '-'")
+
+def _dataset_state_path(dataset_id: str) -> str:
+    _check_dataset_id(dataset_id)
+    return state_path(STATE_DIR, dataset_id)
+
+def _registered_path(dataset_id: str) -> str:
+    _check_dataset_id(dataset_id)
+    return dataset_path(REGISTRY_DIR, dataset_id)
+
+@app.post("/datasets")
+async def register_dataset(request: Request):
+    """
+    Stores the dataset in the request body (any /analyze body format) and
+    returns its datasetId, for /analyze?datasetId= without resending the
+    rows. The id is a hash of the body (and of ?projectType= for Arrow bodies),
+    so registering the same data again returns the same id without storing
+    it twice.
+    """
+    content_type = _content_type(request)
+    body = await _read_body(request)
+    params = dict(request.query_params)
+    # ?projectType= only applies to Arrow bodies (JSON ones carry their own),
+    # so it is part of the id only for them
+    project_type = params.get("projectType") if content_type == ARROW_STREAM_CONTENT_TYPE else None
+    dataset_id = dataset_key([body], content_type, project_type)
+    path = dataset_path(REGISTRY_DIR, dataset_id)
+    if os.path.exists(path):
+        return {"status": "success", "datasetId": dataset_id, "created": False, **dataset_info(path)}
+    info, _ = await _run_job(register_body, path, body, content_type, params, MEMORY_BUDGET)
+    return {"status": "success", "datasetId": dataset_id, "created": True, **info}
+
+@app.post("/query")
+async def query_dataset(request: Request):
+    """
+    Filters, groups, aggregates, sorts and limits the rows of a dataset
+    registered with POST /datasets (?datasetId=), for drill-down without
+    re-running the analysis. The body is a JSON query (see query.QueryPayload).
+    The dataset stays loaded in the worker, with an index of its categorical
+    columns, so later queries only touch the rows they select.
+    """
+    start = time.perf_counter()
+    dataset_id = request.query_params.get("datasetId")
+    if not dataset_id:
+        raise HTTPException(status_code=400, detail="datasetId is required")
+    path = _registered_path(dataset_id)
+    body = await request.body()
+    result, timings = await _run_job(run_query, path, body, QUERY_DATASETS)
+    result = {"status": result["status"], "datasetId": dataset_id, **result}
+    response = _json_response(request, _encode(request, result, timings))
+    seconds = time.perf_counter() - start
+    observe_analysis("/query", timings, result["metadata"]["matchedRows"], len(result["columns"]), seconds)
+    logger.info("query finished", extra={"fields": {
+        "datasetId": dataset_id,
+        "matchedRows": result["metadata"]["matchedRows"],
+        "loaded": result["metadata"]["loaded"],
+        "durationMs": round(seconds * 1000, 3),
+        "stagesMs": timings.as_ms(),
+    }})
+    return response
+
+@app.post("/datasets/{dataset_id}/append")
+async def append_dataset(dataset_id: str, request: Request):
+    """
+    Adds new rows (any /analyze body format) to a dataset, creating it on the
+    first append, and returns its refreshed analysis. Only the new rows are
+    processed: profiles, group aggregates, KPIs and trends are updated from
+    the state stored for the dataset. Charts are chosen on the first append.
+    """
+    start = time.perf_counter()
+    path = _dataset_state_path(dataset_id)
+    _output_options(request.query_params)  # 400 before the rows are appended
+    content_type = _content_type(request)
+    ingest = Timings()
+    with ingest.stage("ingest"):
+        body = await _read_body(request)
+
+    lock = dataset_locks.setdefault(dataset_id, asyncio.Lock())
+    async with lock:
+        result, timings = await _run_job(append_rows, path, body, content_type, dict(request.query_params),
+                                         MEMORY_BUDGET)
+    timings.stages = {**ingest.stages, **timings.stages}
+    response = _json_response(request, _encode(request, result, timings))
+    _record_analysis("/datasets/append", result, timings, start, result["metadata"]["incremental"]["appendedRows"])
+    return response
+
+@app.get("/datasets/{dataset_id}/analysis")
+async def dataset_analysis(dataset_id: str, request: Request):
+    """The current analysis of an appended dataset."""
+    path = _dataset_state_path(dataset_id)
+    result, timings = await _run_job(dataset_result, path)
+    return _json_response(request, _encode(request, result, timings))
+
+@app.delete("/datasets/{dataset_id}")
+async def delete_dataset(dataset_id: str):
+    """Deletes a registered dataset and/or the appended dataset of that id."""
+    path = _dataset_state_path(dataset_id)
+    async with dataset_locks.setdefault(dataset_id, asyncio.Lock()):
+        registered = delete_registered(_registered_path(dataset_id))
+        if not delete_state(path) and not registered:
+            raise HTTPException(status_code=404, detail="Unknown dataset")
+    dataset_locks.pop(dataset_id, None)
+    return {"status": "deleted", "datasetId": dataset_id}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return result_cache.stats()
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/workers/stats")
+async def workers_stats():
+    return worker_pool.stats()
+
+startup["importMs"] = _ms_since(_import_start)
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    # Use string syntax for reload=True to work
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+
+    parser = argparse.ArgumentParser(description="AnalyticsForge analytics engine")
+    parser.add_argument("--production", action="store_true",
+                        help="no file-watching reloader; analysis workers are forked once, after warm-up")
+    parser.add_argument("--workers", type=int, help="analysis worker processes (default: ANALYZE_WORKERS or the CPU count)")
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    args = parser.parse_args()
+    if args.workers is not None:
+        if args.workers < 0:
+            parser.error("--workers must be at least 0")
+        os.environ["ANALYZE_WORKERS"] = str(args.workers)
+        worker_pool = make_worker_pool()  # no process started yet
+
+    # One server process: the result cache and the append locks live in it, and
+    # the analysis workers (worker_pool) provide the parallelism.
+    if args.production:
+        # This module's app, so nothing is imported twice
+        uvicorn.run(app, host=args.host, port=args.port)
+    else:
+        # Use string syntax for reload=True to work
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
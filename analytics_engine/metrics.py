@@ -0,0 +1,171 @@
+"""
+Request timings and the Prometheus text exposition served at /metrics.
+
+Analyses run in worker processes, so stage timings are collected in a
+Timings object that travels back with the result; the metrics themselves
+live in the server process.
+"""
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+ROW_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+COLUMN_BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1_000)
+THROUGHPUT_BUCKETS = (1_000, 10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000)
+
+
+class Timings:
+    """Wall-clock seconds per pipeline stage, and per chart, for one request."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.charts: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    @contextmanager
+    def chart(self, chart_type: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.charts.append((chart_type, time.perf_counter() - start))
+
+    def as_ms(self) -> Dict[str, float]:
+        return {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()}
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...], labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets) + (math.inf,)
+        # label values -> [bucket counts..., sum, count]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, series in self.values.items():
+            for bound, count in zip(self.buckets, series):
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {count}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(series[-2])}"
+            yield f"{self.name}_count{labels} {series[-1]}"
+
+
+class Registry:
+    """
+    Metrics owned by the server process, plus values kept elsewhere (cache,
+    worker pool) that are read at scrape time from collectors: callables
+    returning {name: (type, help, value)}.
+    """
+
+    def __init__(self):
+        self.metrics: List = []
+        self.collectors: List[Callable[[], Dict[str, Tuple[str, str, float]]]] = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            for name, (kind, help, value) in collect().items():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.add(Counter(
+    "analytics_requests_total", "Analysis requests by endpoint and status code.", ("endpoint", "status")))
+REQUEST_SECONDS = registry.add(Histogram(
+    "analytics_request_duration_seconds", "End-to-end analysis request latency.", LATENCY_BUCKETS, ("endpoint",)))
+STAGE_SECONDS = registry.add(Histogram(
+    "analytics_stage_duration_seconds", "Latency of each pipeline stage.", LATENCY_BUCKETS, ("endpoint", "stage")))
+CHART_SECONDS = registry.add(Histogram(
+    "analytics_chart_duration_seconds", "Time to build each chart's data from the shared aggregations.",
+    LATENCY_BUCKETS, ("chart",)))
+ROWS = registry.add(Histogram(
+    "analytics_dataset_rows", "Rows per analyzed dataset.", ROW_BUCKETS, ("endpoint",)))
+COLUMNS = registry.add(Histogram(
+    "analytics_dataset_columns", "Columns per analyzed dataset.", COLUMN_BUCKETS, ("endpoint",)))
+ROWS_PER_SECOND = registry.add(Histogram(
+    "analytics_rows_per_second", "Analysis throughput (rows / request duration).", THROUGHPUT_BUCKETS, ("endpoint",)))
+
+
+def observe_request(endpoint: str, status: int, seconds: float):
+    REQUESTS.inc(endpoint, str(status))
+    REQUEST_SECONDS.observe(seconds, endpoint)
+
+
+def observe_analysis(endpoint: str, timings: Timings, rows: int, columns: int, seconds: Optional[float] = None):
+    """Records one computed (not cached) analysis."""
+    for stage, stage_seconds in timings.stages.items():
+        STAGE_SECONDS.observe(stage_seconds, endpoint, stage)
+    for chart_type, chart_seconds in timings.charts:
+        CHART_SECONDS.observe(chart_seconds, chart_type)
+    ROWS.observe(rows, endpoint)
+    COLUMNS.observe(columns, endpoint)
+    if seconds:
+        ROWS_PER_SECOND.observe(rows / seconds, endpoint)
@@ -0,0 +1,107 @@
+"""
+Partitioned execution of the planned aggregations on large frames.
+
+From a row threshold on, AggregationPlan runs each grouping and
+build_chart_data each histogram on partitions of the rows, one per thread
+of a pool in the worker process. pandas' groupby kernels and numpy's
+reductions release the GIL, so the partitions run on separate cores without
+copying the frame to other processes.
+
+Results are the same as the single pass, bit for bit:
+- groupings: each group's rows all go to one partition (contiguous ranges of
+  sorted groups, balanced by row count), in their original order, so every
+  group is aggregated by the same kernel over the same values; the partition
+  results are concatenated. Merging per-partition partial sums would round
+  floating-point sums differently from pandas' compensated per-group sums,
+  and medians, quantiles and distinct counts have no partial to merge.
+- histograms: row partitions binned against the range of the whole column
+  (merged from each partition's min and max), their counts summed.
+Whole-frame KPI statistics are single vectorized reductions and stay in one
+pass.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Defaults, overridden from the environment by main.py (configure_partitions)
+DEFAULT_MIN_ROWS = 1_000_000
+DEFAULT_THREADS = os.cpu_count() or 1
+
+
+class PartitionPool:
+    """Threads that aggregate frames of at least min_rows rows in up to `threads` partitions."""
+
+    def __init__(self, threads: int = DEFAULT_THREADS, min_rows: int = DEFAULT_MIN_ROWS):
+        self.threads = threads
+        self.min_rows = min_rows
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+
+    def applies(self, rows: int) -> bool:
+        return self.threads > 1 and rows >= self.min_rows
+
+    def _map(self, fn: Callable, items: list) -> list:
+        # Threads do not survive a fork: a worker process starts its own pool
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="partition")
+            self._pid = os.getpid()
+        return list(self._executor.map(fn, items))
+
+    def aggregate_groups(self, frame: pd.DataFrame, key_values: pd.Series,
+                         aggregate: Callable[[object], pd.DataFrame]) -> Optional[pd.DataFrame]:
+        """
+        aggregate(frame.groupby(key_values)) computed per partition of the
+        groups and concatenated; None if frame is below the threshold or its
+        groups do not split (e.g. one group holds most rows).
+        """
+        if not self.applies(len(frame)):
+            return None
+        codes, uniques = pd.factorize(key_values, sort=True)
+        sizes = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        total = sizes.sum()
+        if len(uniques) < 2 or total == 0:
+            return None
+        # Group i goes to the partition its first row would fall in if the
+        # groups' rows were laid out end to end in sorted order
+        first = np.cumsum(sizes) - sizes
+        partition_of = np.minimum(first * self.threads // total, self.threads - 1)
+        bounds = np.searchsorted(partition_of, np.arange(self.threads + 1))
+        ranges = [(low, high) for low, high in zip(bounds[:-1], bounds[1:]) if high > low]
+        if len(ranges) < 2:
+            return None
+
+        def run(code_range: Tuple[int, int]) -> pd.DataFrame:
+            low, high = code_range
+            positions = np.flatnonzero((codes >= low) & (codes < high))
+            result = aggregate(frame.take(positions).groupby(codes[positions]))
+            result.index = uniques.take(result.index).rename(key_values.name)
+            return result
+
+        return pd.concat(self._map(run, ranges))
+
+    def histogram(self, values, bins: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """np.histogram(values, bins), over row partitions from the threshold on."""
+        values = np.asarray(values)
+        if not self.applies(len(values)) or len(values) < self.threads or values.dtype.kind not in "iuf":
+            return np.histogram(values, bins=bins)
+        parts: List[np.ndarray] = np.array_split(values, self.threads)
+        bounds = self._map(lambda part: (part.min(), part.max()), parts)
+        low, high = min(b[0] for b in bounds), max(b[1] for b in bounds)
+        if not (np.isfinite(low) and np.isfinite(high)):
+            # Same error as the single pass
+            return np.histogram(values, bins=bins)
+        counts = self._map(lambda part: np.histogram(part, bins=bins, range=(low, high)), parts)
+        return sum(c for c, _ in counts), counts[0][1]
+
+
+partition_pool = PartitionPool()
+
+
+def configure_partitions(threads: int, min_rows: int):
+    """Sets the threads and row threshold of the partitioned execution (threads <= 1 turns it off)."""
+    partition_pool.threads = threads
+    partition_pool.min_rows = min_rows
+    partition_pool._executor = None
@@ -0,0 +1,402 @@
+"""
+The CPU-bound part of a request: building the DataFrame from the request body
+and running the analysis pipeline on it. Kept free of app state so the
+functions can run in a worker process (see workers.py).
+"""
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+from typing import List, Dict, Any, Mapping, Optional, Tuple
+import copy
+import logging
+import pandas as pd
+import json
+from admission import OverBudget, estimate_memory, over_budget_message, streaming_chunk_size
+from analyzer import analyze_dataframe
+from chart_recommender import recommend_charts
+from correlation import correlation_summary
+from chart_data import build_chart_data, summed_columns
+from dates import DateCache
+from incremental import StateVersionError, load_state, save_state
+from ingest import (
+    ARROW_STREAM_CONTENT_TYPE,
+    IngestError,
+    NotChunkable,
+    compact_frame,
+    frame_from_arrow_stream,
+    frame_from_columns,
+    frame_from_rows,
+    iter_arrow_chunks,
+    iter_row_chunks,
+    make_unique_columns,
+)
+from logs import get_logger
+from metrics import Timings
+from profiling import active_profile
+from query import LoadedDataset, loaded_dataset
+from registry import dataset_info, store_frame
+from sampling import DEFAULT_SEED, RowSampler
+from sketches import describe_sketches
+from streaming import DEFAULT_CHUNK_SIZE, ChunkedAnalysis, analyze_chunks, analyze_csv_chunked
+
+logger = get_logger("pipeline")
+
+
+class DataPayload(BaseModel):
+    data: List[Dict[str, Any]]
+    projectType: str = "general"
+
+
+def _log_crash(e: Exception):
+    logger.exception("Python engine crash: %s", e)
+
+
+def _out_of_memory() -> HTTPException:
+    # Past the admission estimate's margin (concurrent requests, unusual values):
+    # the request fails, the worker stays up
+    logger.warning("analysis ran out of memory")
+    return HTTPException(status_code=503, detail="Not enough memory to analyze this payload, retry later",
+                         headers={"Retry-After": "5"})
+
+
+def read_payload(body: bytes, content_type: str, query_params: Mapping[str, str],
+                 memory_budget: Optional[int] = None) -> Tuple[pd.DataFrame, str]:
+    """
+    Builds the DataFrame from the request body, chosen by content type:
+    - application/vnd.apache.arrow.stream: Arrow IPC stream (projectType from
+      the ?projectType= query param or the schema metadata)
+    - application/json with "columns": {name: [values]} (column-oriented)
+    - application/json with "data": [{...}] (row-oriented, validated by DataPayload)
+    413 if the body is estimated to need more than memory_budget bytes.
+    """
+    if memory_budget is not None:
+        estimate, _ = estimate_memory(body, content_type)
+        if estimate > memory_budget:
+            raise HTTPException(status_code=413, detail=over_budget_message(estimate, memory_budget))
+    try:
+        if content_type == ARROW_STREAM_CONTENT_TYPE:
+            df, metadata = frame_from_arrow_stream(body)
+            project_type = query_params.get("projectType") or metadata.get("projectType") or "general"
+            return df, project_type
+
+        try:
+            raw = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body is not valid JSON")
+
+        if isinstance(raw, dict) and "columns" in raw:
+            project_type = raw.get("projectType", "general")
+            if not isinstance(project_type, str):
+                raise IngestError("'projectType' must be a string")
+            return frame_from_columns(raw["columns"]), project_type
+
+        try:
+            payload = DataPayload.model_validate(raw)
+        except ValidationError as e:
+            raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors()])
+        return frame_from_rows(payload.data), payload.projectType
+    except IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def parse_flag(value) -> bool:
+    """Boolean query/form parameter: true/1/yes/on (any case) is True."""
+    return str(value).strip().lower() in ("true", "1", "yes", "on")
+
+
+def parse_int(params: Mapping[str, str], name: str, default: Optional[int], minimum: int) -> Optional[int]:
+    """Integer query parameter (default when absent); 400 if malformed or below minimum."""
+    raw = params.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an integer")
+    if value < minimum:
+        raise HTTPException(status_code=400, detail=f"{name} must be at least {minimum}")
+    return value
+
+
+def sampler_from_params(params: Mapping[str, str]) -> RowSampler:
+    """The request's point sampler: ?sampleSize= (points per chart) and ?sampleSeed=."""
+    return RowSampler(parse_int(params, "sampleSize", None, 1), parse_int(params, "sampleSeed", DEFAULT_SEED, 0))
+
+
+def prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalizes an ingested frame in place before profiling. "Record Count" is
+    not added: it stays virtual (see ingest.RECORD_COUNT).
+    """
+    # Normalize column names (common cause of "same column" bugs).
+    df.columns = make_unique_columns([str(c) for c in df.columns])
+    return df
+
+
+def analyze_body(body: bytes, content_type: str, query_params: Mapping[str, str],
+                 memory_budget: Optional[int] = None) -> Tuple[Dict[str, Any], Timings]:
+    """
+    Runs /analyze on a raw request body. Returns the response content and stage timings.
+    ?approximate=true trades exact distinct counts, quartiles and histogram
+    counts for sketch estimates with error bounds. ?sampleSize= and
+    ?sampleSeed= control the points drawn for scatter charts.
+    A body estimated to need more than memory_budget bytes is analyzed in
+    streaming mode (see analyze_body_chunked), or rejected with 413.
+    """
+    timings = Timings()
+    try:
+        estimate, rows = estimate_memory(body, content_type)
+        if memory_budget is not None and estimate > memory_budget:
+            return analyze_body_chunked(body, content_type, query_params, timings, estimate, rows, memory_budget)
+        with timings.stage("build_frame"):
+            df, project_type = read_payload(body, content_type, query_params)
+        return analyze_frame(df, project_type, query_params, timings)
+    except MemoryError:
+        raise _out_of_memory()
+
+
+def analyze_body_chunked(body: bytes, content_type: str, query_params: Mapping[str, str], timings: Timings,
+                         estimate: int, rows: int, memory_budget: int) -> Tuple[Dict[str, Any], Timings]:
+    """
+    Streaming mode of /analyze, for bodies over the memory budget: the rows
+    (JSON "data" rows or Arrow batches) are decoded a chunk at a time and
+    analyzed like /analyze/csv with approximate=true, so distinct counts,
+    quartiles and histogram counts come from sketches. The response reports
+    the mode in metadata["admission"] (and the chunking in metadata["streaming"]).
+    413 for column-oriented bodies, which can only be decoded whole, and for
+    bodies too large for any chunk to fit next to them.
+    """
+    sampler = sampler_from_params(query_params)
+    fields: Dict[str, Any] = {}
+
+    def project_type() -> str:
+        # Known once the whole body has been read
+        if content_type == ARROW_STREAM_CONTENT_TYPE:
+            return query_params.get("projectType") or fields.get("projectType") or "general"
+        value = fields.get("projectType", "general")
+        if not isinstance(value, str):
+            raise IngestError("'projectType' must be a string")
+        return value
+
+    try:
+        chunk_size = streaming_chunk_size(body, content_type, estimate, rows, memory_budget, DEFAULT_CHUNK_SIZE)
+        if content_type == ARROW_STREAM_CONTENT_TYPE:
+            read_chunks = lambda: iter_arrow_chunks(body, chunk_size, fields)
+        else:
+            read_chunks = lambda: iter_row_chunks(body, chunk_size, fields)
+        result = analyze_chunks(read_chunks, project_type, chunk_size, sampler.seed, timings,
+                                approximate=True, sample_size=sampler.size)
+    except OverBudget as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except NotChunkable:
+        raise HTTPException(status_code=413, detail=over_budget_message(
+            estimate, memory_budget, "send it as rows or an Arrow stream to analyze it in streaming mode"))
+    except IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except MemoryError:
+        raise _out_of_memory()
+    except Exception as e:
+        _log_crash(e)
+        raise HTTPException(status_code=500, detail=f"Python Engine Error: {str(e)}")
+
+    if result["analysis"]["row_count"] == 0:
+        raise HTTPException(status_code=400, detail="Empty data provided")
+    result["metadata"]["admission"] = {
+        "mode": "streaming",
+        "estimatedBytes": estimate,
+        "budgetBytes": memory_budget,
+    }
+    return {"status": "success", "projectType": project_type(), **result}, timings
+
+
+def analyze_frame(df: pd.DataFrame, project_type: str, query_params: Mapping[str, str],
+                  timings: Timings, dataset: Optional[LoadedDataset] = None) -> Tuple[Dict[str, Any], Timings]:
+    """
+    The analysis pipeline on an ingested frame (see analyze_body for the query
+    parameters). For a loaded registered dataset (df is a shallow copy of its
+    frame), its exact profile, parsed dates and rollup cube are reused.
+    """
+    approximate = parse_flag(query_params.get("approximate", ""))
+    sampler = sampler_from_params(query_params)
+    try:
+        if df.empty:
+            raise HTTPException(status_code=400, detail="Empty data provided")
+
+        prepare_frame(df)
+
+        # Formatting these is costly on wide frames: only when DEBUG is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("DataFrame shape: %s", df.shape)
+            logger.debug("DataFrame columns: %s", df.columns.tolist())
+            logger.debug("DataFrame dtypes:\n%s", df.dtypes)
+
+        # Analyze data types and structure
+        with timings.stage("profile"):
+            if dataset is not None and not approximate:
+                date_cache = dataset.date_cache
+                analysis, correlation = copy.deepcopy(dataset.analysis), dataset.correlation
+            else:
+                date_cache = DateCache()
+                analysis = analyze_dataframe(df, date_cache, approximate)
+                correlation = correlation_summary(df, analysis)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Analysis Result: %s", analysis)
+
+        # Get chart recommendations
+        with timings.stage("recommend"):
+            recommendations = recommend_charts(analysis, project_type, correlation)
+
+        # Smaller dtypes for the aggregation stage, decided from the profile
+        # and what the charts and KPIs aggregate
+        with timings.stage("compact"):
+            compact_frame(df, analysis, summed_columns(recommendations))
+
+        # Aggregate the data each chart and KPI needs (shared groupbys)
+        build_chart_data(recommendations, df, analysis, date_cache, timings, approximate, sampler,
+                         dataset.cube if dataset is not None else None)
+        profile = active_profile()
+        if profile is not None:
+            profile.take_snapshot()
+
+        metadata = recommendations["metadata"]
+        if approximate:
+            metadata = {**metadata, "approximate": describe_sketches()}
+
+        return {
+            "status": "success",
+            "projectType": project_type,
+            "analysis": analysis,
+            "charts": recommendations["charts"],
+            "kpis": recommendations["kpis"],
+            "metadata": metadata
+        }, timings
+
+    except HTTPException:
+        raise
+    except MemoryError:
+        raise _out_of_memory()
+    except Exception as e:
+        _log_crash(e)
+        raise HTTPException(status_code=500, detail=f"Python Engine Error: {str(e)}")
+
+
+def analyze_csv_file(path: str, project_type: str, chunk_size: int, approximate: bool = False,
+                     sample_size: Optional[int] = None,
+                     sample_seed: int = DEFAULT_SEED) -> Tuple[Dict[str, Any], Timings]:
+    """Runs /analyze/csv on an uploaded file saved at path. Returns the response content and stage timings."""
+    timings = Timings()
+    try:
+        with open(path, "rb") as f:
+            result = analyze_csv_chunked(f, project_type, chunk_size, seed=sample_seed, timings=timings,
+                                         approximate=approximate, sample_size=sample_size)
+        return {
+            "status": "success",
+            "projectType": project_type,
+            **result
+        }, timings
+    except pd.errors.EmptyDataError:
+        raise HTTPException(status_code=400, detail="Empty data provided")
+    except Exception as e:
+        _log_crash(e)
+        raise HTTPException(status_code=500, detail=f"Python Engine Error: {str(e)}")
+
+
+def append_rows(path: str, body: bytes, content_type: str, query_params: Mapping[str, str],
+                memory_budget: Optional[int] = None) -> Tuple[Dict[str, Any], Timings]:
+    """
+    Runs /datasets/{id}/append: adds the rows in the request body (any /analyze
+    body format) to the dataset state stored at path, creating it on the first
+    append, and returns the refreshed response content and stage timings.
+
+    Only the new rows are processed. Statistics that cannot be merged exactly
+    (distinct counts, quartiles, histogram bins) come from sketches, as in
+    ?approximate=true; totals, means, groups and trends are exact.
+    413 if the body is estimated to need more than memory_budget bytes.
+    """
+    timings = Timings()
+    with timings.stage("build_frame"):
+        df, project_type = read_payload(body, content_type, query_params, memory_budget)
+    if df.empty:
+        raise HTTPException(status_code=400, detail="Empty data provided")
+    try:
+        with timings.stage("load_state"):
+            state = load_state(path)
+        created = state is None
+        if created:
+            state = ChunkedAnalysis(project_type, approximate=True)
+
+        analysis = state.append(df, timings)
+        result = state.result(timings, analysis)
+        result["metadata"]["incremental"] = {"created": created, "appends": state.chunk_count, "appendedRows": len(df)}
+
+        with timings.stage("save_state"):
+            save_state(path, state)
+        return {"status": "success", "projectType": state.project_type, **result}, timings
+    except StateVersionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        _log_crash(e)
+        raise HTTPException(status_code=500, detail=f"Python Engine Error: {str(e)}")
+
+
+def dataset_result(path: str) -> Tuple[Dict[str, Any], Timings]:
+    """The current response content of an appended dataset (404 if it has none)."""
+    timings = Timings()
+    try:
+        state = load_state(path)
+    except StateVersionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown dataset")
+    try:
+        result = state.result(timings)
+        result["metadata"]["incremental"] = {"appends": state.chunk_count}
+        return {"status": "success", "projectType": state.project_type, **result}, timings
+    except Exception as e:
+        _log_crash(e)
+        raise HTTPException(status_code=500, detail=f"Python Engine Error: {str(e)}")
+
+
+def register_body(path: str, body: bytes, content_type: str, query_params: Mapping[str, str],
+                  memory_budget: Optional[int] = None) -> Tuple[Dict[str, Any], Timings]:
+    """
+    Runs POST /datasets: stores the dataset in the request body (any /analyze
+    format) at path. 413 if it is estimated to need more than memory_budget bytes.
+    """
+    timings = Timings()
+    with timings.stage("build_frame"):
+        df, project_type = read_payload(body, content_type, query_params, memory_budget)
+    if df.empty:
+        raise HTTPException(status_code=400, detail="Empty data provided")
+    prepare_frame(df)
+    try:
+        with timings.stage("store"):
+            store_frame(path, df, project_type)
+    except IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        _log_crash(e)
+        raise HTTPException(status_code=500, detail=f"Python Engine Error: {str(e)}")
+    return dataset_info(path), timings
+
+
+def analyze_registered(path: str, query_params: Mapping[str, str],
+                       max_datasets: int) -> Tuple[Dict[str, Any], Timings]:
+    """
+    Runs /analyze?datasetId= on the dataset stored at path (404 if none),
+    kept loaded in this process like /query datasets (up to max_datasets).
+    ?projectType= overrides the project type it was registered with.
+    """
+    timings = Timings()
+    with timings.stage("load"):
+        try:
+            dataset, _ = loaded_dataset(path, max_datasets)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Unknown dataset")
+        except IngestError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    project_type = query_params.get("projectType") or dataset.project_type
+    # Shallow: the pipeline replaces columns (compact_frame) but never writes into them
+    return analyze_frame(dataset.frame.copy(deep=False), project_type, query_params, timings, dataset)
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Hashable, List, Optional
+
+from partitioned import partition_pool
+
+# Quantile aggregations, computed with one multi-quantile call per key
+QUANTILE_FUNCS = {"q1": 0.25, "q3": 0.75}
+
+# What each aggregation of a column of 1s comes to, given the row count n
+# (an int, or an array of group sizes); anything else (mean, median,
+# quantiles) is 1.0.
+_COUNT_COLUMN_FUNCS = {
+    "sum": lambda n: n,
+    "count": lambda n: n,
+    "size": lambda n: n,
+    "nunique": lambda n: np.minimum(n, 1),
+    "min": lambda n: n * 0 + 1,
+    "max": lambda n: n * 0 + 1,
+}
+
+
+class AggregationPlan:
+    """
+    Collects the groupby aggregations that charts and KPIs need, then runs
+    each distinct grouping key once with all of its aggregations together.
+
+    Keys are column names, or names registered with add_key() for derived
+    keys such as month buckets. Whole-frame KPI statistics use key None.
+
+    count_column names a virtual column of 1s that is not stored in the frame
+    (see ingest.RECORD_COUNT): its aggregations are derived from group sizes.
+
+    Keys whose aggregations a rollup cube of the frame covers (see rollup.py)
+    are answered from its cells instead of the rows. On large frames the other
+    groupings run in partitions on several threads (see partitioned.py).
+    """
+
+    def __init__(self, count_column: Optional[str] = None, cube=None):
+        self.count_column = count_column
+        self.cube = cube
+        self.cube_keys: List[Optional[Hashable]] = []
+        self.needs: Dict[Optional[Hashable], Dict[str, List[str]]] = {}
+        self.derived_keys: Dict[Hashable, pd.Series] = {}
+        self.results: Dict[Optional[Hashable], Any] = {}
+
+    def add_key(self, name: Hashable, values: pd.Series):
+        """Registers a derived grouping key (a Series aligned with the frame)."""
+        self.derived_keys[name] = values
+
+    def need(self, key: Optional[Hashable], columns, *funcs: str):
+        """
+        Requests funcs of columns grouped by key: any pandas aggregation name
+        ("sum", "mean", "median", "count", ...) or a QUANTILE_FUNCS name.
+        """
+        if isinstance(columns, str):
+            columns = [columns]
+        by_column = self.needs.setdefault(key, {})
+        for column in columns:
+            column_funcs = by_column.setdefault(column, [])
+            for func in funcs:
+                if func not in column_funcs:
+                    column_funcs.append(func)
+
+    def column(self, df: pd.DataFrame, name: str) -> pd.Series:
+        """A column of df, materializing the virtual count column if asked for."""
+        if name == self.count_column:
+            return pd.Series(np.ones(len(df), dtype=np.int64), index=df.index, name=name)
+        return df[name]
+
+    def execute(self, df: pd.DataFrame):
+        """Runs one groupby (or one whole-frame aggregation) per planned key."""
+        for key, spec in self.needs.items():
+            result = self._from_cube(key, spec) if self.cube is not None else None
+            if result is not None:
+                self.results[key] = result
+                self.cube_keys.append(key)
+            elif key is None:
+                self.results[None] = {column: self._agg_column(df, column, funcs) for column, funcs in spec.items()}
+            else:
+                # Group by the key values (not the name) so the key column itself
+                # can also be aggregated, e.g. summing X grouped by X.
+                key_values = self.derived_keys[key] if key in self.derived_keys else self.column(df, key)
+                columns = [column for column in spec if column != self.count_column]
+                result = partition_pool.aggregate_groups(
+                    df[columns], key_values, lambda grouped, spec=spec: self._aggregate(grouped, spec))
+                self.results[key] = result if result is not None else self._aggregate(df.groupby(key_values), spec)
+        return self
+
+    def _from_cube(self, key: Optional[Hashable], spec: Dict[str, List[str]]):
+        # Same layout as the groupby (or whole-frame) results; None if the cube
+        # does not hold the aggregations or its float sums are not precise enough
+        if not self.cube.covers([] if key is None else [key], spec, self.count_column):
+            return None
+        stats, sizes = self.cube.rollup([] if key is None else [key])
+        summed = [column for column, funcs in spec.items() if "sum" in funcs or "mean" in funcs]
+        if not self.cube.within_tolerance(stats, summed):
+            return None
+
+        def value(column, func):
+            if column == self.count_column:
+                return pd.Series(self._count_column_stat(func, sizes.to_numpy()), index=sizes.index)
+            return self.cube.value(stats, sizes, column, func)
+
+        if key is None:
+            return {column: pd.Series({func: value(column, func).iloc[0] for func in funcs}, name=column)
+                    for column, funcs in spec.items()}
+        return pd.DataFrame({(column, func): value(column, func) for column, funcs in spec.items() for func in funcs})
+
+    def _agg_column(self, df: pd.DataFrame, column: str, funcs: List[str]) -> pd.Series:
+        if column == self.count_column:
+            return pd.Series({func: self._count_column_stat(func, len(df)) for func in funcs}, name=column)
+        return df[column].agg(funcs)
+
+    @staticmethod
+    def _count_column_stat(func: str, sizes):
+        if func in _COUNT_COLUMN_FUNCS:
+            return _COUNT_COLUMN_FUNCS[func](sizes)
+        return sizes * 0 + 1.0
+
+    def _aggregate(self, grouped, spec: Dict[str, List[str]]) -> pd.DataFrame:
+        virtual = spec.get(self.count_column) if self.count_column else None
+        if virtual is not None:
+            spec = {column: funcs for column, funcs in spec.items() if column != self.count_column}
+
+        named = {column: [f for f in funcs if f not in QUANTILE_FUNCS] for column, funcs in spec.items()}
+        named = {column: funcs for column, funcs in named.items() if funcs}
+        wanted = {column: [f for f in funcs if f in QUANTILE_FUNCS] for column, funcs in spec.items()}
+        wanted = {column: funcs for column, funcs in wanted.items() if funcs}
+
+        result = grouped.agg(named) if named else None
+        if wanted:
+            levels = sorted({QUANTILE_FUNCS[f] for funcs in wanted.values() for f in funcs})
+            quantiles = grouped[list(wanted)].quantile(levels).unstack()
+            if result is None:
+                result = pd.DataFrame(index=quantiles.index)
+            for column, funcs in wanted.items():
+                for func in funcs:
+                    result[(column, func)] = quantiles[(column, QUANTILE_FUNCS[func])]
+        if virtual is not None:
+            sizes = grouped.size()
+            if result is None:
+                result = pd.DataFrame(index=sizes.index)
+            for func in virtual:
+                result[(self.count_column, func)] = pd.Series(
+                    self._count_column_stat(func, sizes.to_numpy()), index=sizes.index)
+        return result
+
+    def get(self, key: Optional[Hashable], column: str, func: str):
+        """Result of func(column) per group of key (a Series), or a scalar for key None."""
+        if key is None:
+            return self.results[None][column][func]
+        return self.results[key][(column, func)]
+
+    def group_count(self, key: Hashable) -> Optional[int]:
+        """Number of non-null groups for a planned key (its nunique), if it was run."""
+        result = self.results.get(key)
+        return len(result) if result is not None else None
@@ -0,0 +1,142 @@
+"""
+Opt-in profiling of one analysis (/analyze?profile=true; see main.py for who
+may ask for it).
+
+run_profiled() runs an analysis job under cProfile and tracemalloc and adds
+metadata["profile"] to its result:
+- "wallMs" and "stagesMs": the whole job and its pipeline stages
+- "charts": wall time of each chart builder, in chart order
+- "columns": wall time of each column in analyze_dataframe's per-column pass
+  (type and date detection; the frame-wide null, distinct and min/max counts
+  are part of the "profile" stage), when the profile is not reused
+- "functions": the functions with the most time of their own
+- "memory": the traced peak and the source lines holding the most memory
+  once the charts are built (Python and numpy allocations; Arrow buffers
+  are not traced)
+
+Both profilers slow the job down, tracemalloc by a lot, so the times are for
+comparing parts of one request. Without the flag nothing is traced or timed
+beyond the stages: the pipeline's hooks only find active_profile() is None.
+"""
+import cProfile
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import Timings
+
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 10
+
+# Frames kept per traced allocation (the allocating line is enough)
+TRACE_FRAMES = 1
+
+_active: Optional["RequestProfile"] = None
+
+
+class RequestProfile:
+    """What one profiled job records besides its Timings."""
+
+    def __init__(self, profiler: cProfile.Profile):
+        self.profiler = profiler
+        self.columns: List[Tuple[str, float]] = []
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+
+    @contextmanager
+    def column(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.columns.append((name, time.perf_counter() - start))
+
+    def take_snapshot(self):
+        """Records the traced allocations held now (called while the frame and every aggregation are alive)."""
+        # Not part of the job's own functions
+        self.profiler.disable()
+        try:
+            self.snapshot = tracemalloc.take_snapshot()
+        finally:
+            self.profiler.enable()
+
+
+def active_profile() -> Optional[RequestProfile]:
+    """The profile of the job running in this process, if it is profiled."""
+    return _active
+
+
+def run_profiled(fn: Callable, *args) -> Tuple[Dict[str, Any], Timings]:
+    """fn(*args) (an analysis job returning (result, timings)) with metadata["profile"] added."""
+    global _active
+    profiler = cProfile.Profile()
+    profile = RequestProfile(profiler)
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start(TRACE_FRAMES)
+    tracemalloc.reset_peak()
+    _active = profile
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+        try:
+            result, timings = fn(*args)
+        finally:
+            profiler.disable()
+        wall = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        if profile.snapshot is None:
+            profile.snapshot = tracemalloc.take_snapshot()
+    finally:
+        _active = None
+        if not tracing:
+            tracemalloc.stop()
+
+    result["metadata"]["profile"] = {
+        "wallMs": _ms(wall),
+        "stagesMs": timings.as_ms(),
+        "charts": [{"type": chart_type, "ms": _ms(seconds)} for chart_type, seconds in timings.charts],
+        "columns": [{"name": name, "ms": _ms(seconds)} for name, seconds in profile.columns],
+        "functions": _top_functions(profiler),
+        "memory": {"peakBytes": peak, "top": _top_allocations(profile.snapshot)},
+    }
+    return result, timings
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def _short_path(path: str) -> str:
+    # Enough of the path to tell the module: "pandas/core/frame.py", "analyzer.py"
+    parts = path.replace("\\", "/").split("/")
+    for marker in ("site-packages", "lib"):
+        if marker in parts:
+            parts = parts[len(parts) - parts[::-1].index(marker):]
+            return "/".join(parts[-3:])
+    return parts[-1]
+
+
+def _top_functions(profiler: cProfile.Profile) -> List[Dict[str, Any]]:
+    stats = pstats.Stats(profiler).stats
+    top = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_FUNCTIONS]
+    return [{
+        "function": name if path == "~" else f"{name} ({_short_path(path)}:{line})",
+        "calls": calls,
+        "ownMs": _ms(own),
+        "cumulativeMs": _ms(cumulative),
+    } for (path, line, name), (_, calls, own, cumulative, _) in top]
+
+
+def _top_allocations(snapshot: tracemalloc.Snapshot) -> List[Dict[str, Any]]:
+    # Leave out what tracemalloc and this module allocate themselves
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    return [{
+        "site": f"{_short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+        "bytes": stat.size,
+        "count": stat.count,
+    } for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]]
@@ -0,0 +1,479 @@
+"""
+Interactive queries on registered datasets: filters, group-by, aggregations,
+sort and limit, for drill-down after the first /analyze.
+
+A queried dataset stays loaded in the process that ran the query (see
+DatasetStore), together with a dictionary-encoded index of each column that
+is not floating point and has few distinct values: the column as integer
+codes, and the row positions of every code. Filters on an indexed column are
+evaluated once per distinct value and then either look up the matching row
+positions or test the codes of the rows still selected; group-bys combine
+the codes of the grouping columns instead of hashing values. A query then
+costs in proportion to the rows it selects, not the dataset.
+
+Comparisons never match nulls (only isNull does).
+"""
+import json
+import operator
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Literal, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field, ValidationError
+
+from analyzer import analyze_dataframe
+from correlation import correlation_summary
+from dates import DateCache
+from ingest import RECORD_COUNT, IngestError
+from logs import get_logger
+from metrics import Timings
+from registry import load_frame
+from rollup import SUM_TOLERANCE, RollupCube, parse_dimension
+
+logger = get_logger("query")
+
+DEFAULT_LIMIT = 1_000
+MAX_LIMIT = 100_000
+
+# Columns with more distinct values than this (or than half their rows) are
+# not indexed: ids and free text, where an index would not narrow anything
+INDEX_MAX_UNIQUE = 50_000
+
+# Below this share of the rows, filters collect the rows of the matching codes
+# from the index; above it, testing every row's code is cheaper
+INDEX_LOOKUP_SHARE = 0.125
+
+_COMPARISONS = {
+    "eq": operator.eq, "ne": operator.ne,
+    "gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le,
+}
+
+
+class QueryFilter(BaseModel):
+    column: str
+    op: Literal["eq", "ne", "gt", "gte", "lt", "lte", "in", "notIn", "isNull", "notNull"] = "eq"
+    value: Any = None
+
+
+class QueryAggregation(BaseModel):
+    func: Literal["count", "sum", "mean", "min", "max", "nunique"] = "count"
+    column: Optional[str] = None  # count only: None counts rows
+    name: Optional[str] = None
+
+
+class QuerySort(BaseModel):
+    column: str
+    descending: bool = False
+
+
+class QueryPayload(BaseModel):
+    filters: List[QueryFilter] = []
+    groupBy: List[str] = []
+    aggregations: List[QueryAggregation] = []
+    columns: Optional[List[str]] = None  # rows without groupBy/aggregations: the columns returned
+    sort: List[QuerySort] = []
+    limit: int = Field(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT)
+
+
+class ColumnIndex:
+    """
+    Dictionary encoding of one column. Code 0 stands for null and code c > 0
+    for uniques[c - 1]; the rows of code c are positions[offsets[c]:offsets[c + 1]],
+    in row order.
+    """
+
+    def __init__(self, codes: np.ndarray, uniques: pd.Index):
+        self.uniques = uniques
+        self.codes = (codes + 1).astype(np.int32)
+        self.counts = np.bincount(self.codes, minlength=len(uniques) + 1)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+        self.positions = np.argsort(self.codes, kind="stable").astype(np.int32)
+
+    @classmethod
+    def build(cls, values: pd.Series) -> Optional["ColumnIndex"]:
+        """The index of a column, or None if it should not have one."""
+        if pd.api.types.is_float_dtype(values):
+            return None
+        codes, uniques = pd.factorize(values)
+        if len(uniques) > min(INDEX_MAX_UNIQUE, max(len(values) // 2, 1)):
+            return None
+        return cls(codes, pd.Index(uniques))
+
+    def rows(self, codes: np.ndarray) -> np.ndarray:
+        """Row positions of the given codes, in row order."""
+        parts = [self.positions[self.offsets[c]:self.offsets[c + 1]] for c in codes]
+        if not parts:
+            return np.zeros(0, dtype=np.int32)
+        return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+
+class LoadedDataset:
+    """
+    A registered dataset and what is derived from it once, at load time: the
+    column indexes, its exact profile (analysis, correlations, parsed dates)
+    and its rollup cube.
+    """
+
+    def __init__(self, frame: pd.DataFrame, project_type: str, mtime: float):
+        self.frame = frame
+        self.project_type = project_type
+        self.mtime = mtime
+        self.indexes: Dict[str, ColumnIndex] = {}
+        for col in frame.columns:
+            index = ColumnIndex.build(frame[col])
+            if index is not None:
+                self.indexes[col] = index
+        self.date_cache = DateCache()
+        self.analysis = analyze_dataframe(frame, self.date_cache)
+        self.correlation = correlation_summary(frame, self.analysis)
+        self.cube = RollupCube.build(frame, self.analysis, self.date_cache)
+
+
+class DatasetStore:
+    """The datasets loaded in this process, least recently queried dropped first."""
+
+    def __init__(self, max_datasets: int):
+        self.max_datasets = max_datasets
+        self._datasets: "OrderedDict[str, LoadedDataset]" = OrderedDict()
+
+    def get(self, path: str) -> Tuple[LoadedDataset, bool]:
+        """The dataset stored at path and whether it was loaded now. Raises FileNotFoundError."""
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            self._datasets.pop(path, None)  # deleted since it was loaded
+            raise
+        dataset = self._datasets.get(path)
+        if dataset is not None and dataset.mtime == mtime:
+            self._datasets.move_to_end(path)
+            return dataset, False
+        frame, metadata = load_frame(path)
+        dataset = LoadedDataset(frame, metadata.get("projectType") or "general", mtime)
+        self._datasets[path] = dataset
+        self._datasets.move_to_end(path)
+        while len(self._datasets) > max(self.max_datasets, 1):
+            self._datasets.popitem(last=False)
+        return dataset, True
+
+
+# One per process: each worker keeps the datasets it has queried
+_store = DatasetStore(max_datasets=4)
+
+
+def loaded_dataset(path: str, max_datasets: int) -> Tuple[LoadedDataset, bool]:
+    """This process' copy of the dataset stored at path (see DatasetStore.get)."""
+    _store.max_datasets = max_datasets
+    return _store.get(path)
+
+
+def _parse_query(body: bytes) -> QueryPayload:
+    try:
+        raw = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body is not valid JSON")
+    try:
+        return QueryPayload.model_validate(raw)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors()])
+
+
+def _check_columns(frame: pd.DataFrame, names: List[str]):
+    unknown = [name for name in names if name not in frame.columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown column '{unknown[0]}'")
+
+
+def _as_mask(result) -> np.ndarray:
+    if isinstance(result, np.ndarray):
+        return result.astype(bool, copy=False)
+    return result.to_numpy(dtype=bool, na_value=False)
+
+
+def _matches(values, f: QueryFilter) -> np.ndarray:
+    """Which of values (a Series, or an index's uniques) pass the filter."""
+    if f.op == "isNull":
+        return np.asarray(pd.isna(values))
+    present = np.asarray(pd.notna(values))
+    if f.op == "notNull":
+        return present
+    if f.op in ("in", "notIn"):
+        if not isinstance(f.value, list):
+            raise HTTPException(status_code=400, detail=f"Filter '{f.op}' on '{f.column}' needs a list value")
+        hits = _as_mask(values.isin(f.value))
+        return hits if f.op == "in" else ~hits & present
+    try:
+        return _as_mask(_COMPARISONS[f.op](values, f.value)) & present
+    except TypeError:
+        raise HTTPException(status_code=400, detail=f"Cannot compare column '{f.column}' with {f.value!r}")
+
+
+def _select(dataset: LoadedDataset, filters: List[QueryFilter], used: List[str]) -> Optional[np.ndarray]:
+    """Positions of the rows passing every filter, in row order (None: all rows)."""
+    frame = dataset.frame
+    indexed, scanned = [], []
+    for f in filters:
+        index = dataset.indexes.get(f.column)
+        if index is None:
+            scanned.append(f)
+            continue
+        # Evaluated once per distinct value (code 0: null)
+        code_mask = np.concatenate([[f.op == "isNull"], _matches(index.uniques, f)])
+        indexed.append((int(index.counts[code_mask].sum()), index, code_mask))
+        used.append(f.column)
+
+    positions = None
+    # Most selective first, so later filters test fewer rows
+    for matched, index, code_mask in sorted(indexed, key=lambda item: item[0]):
+        if positions is None:
+            if matched < INDEX_LOOKUP_SHARE * len(frame):
+                positions = index.rows(np.flatnonzero(code_mask))
+            else:
+                positions = np.flatnonzero(code_mask[index.codes])
+        else:
+            positions = positions[code_mask[index.codes[positions]]]
+    for f in scanned:
+        values = frame[f.column]
+        if positions is None:
+            positions = np.flatnonzero(_matches(values, f))
+        else:
+            positions = positions[_matches(values.iloc[positions], f)]
+    return positions
+
+
+def _take(frame: pd.DataFrame, column: str, positions: Optional[np.ndarray]) -> pd.Series:
+    values = frame[column]
+    return values if positions is None else values.iloc[positions]
+
+
+def _dimension_values(dataset: LoadedDataset, dim, positions: Optional[np.ndarray]) -> pd.Series:
+    """A group-by column's values, or a date column's months for month(<column>)."""
+    if isinstance(dim, tuple):
+        months = dataset.date_cache.parsed(dataset.frame, dim[1]).dt.to_period("M")
+        return months if positions is None else months.iloc[positions]
+    return _take(dataset.frame, dim, positions)
+
+
+def _label(value):
+    if value is None or (not isinstance(value, (list, dict)) and pd.isna(value)):
+        return None
+    return str(value) if isinstance(value, pd.Period) else value
+
+
+def _group_codes(dataset: LoadedDataset, positions: Optional[np.ndarray], group_by: List[str],
+                 used: List[str]) -> Tuple[np.ndarray, Dict[str, list]]:
+    """Group number of every selected row, and the group-by values of each group."""
+    codes, labels = [], []
+    for name in group_by:
+        dim = parse_dimension(name)
+        index = dataset.indexes.get(dim)
+        if index is not None:
+            col_codes = index.codes if positions is None else index.codes[positions]
+            uniques = index.uniques
+            used.append(dim)
+        else:
+            col_codes, uniques = pd.factorize(_dimension_values(dataset, dim, positions))
+            col_codes = col_codes + 1
+        codes.append(col_codes.astype(np.int64))
+        labels.append([None] + [_label(value) for value in uniques.tolist()])
+
+    # One key per combination of codes (mixed radix), compacted to its
+    # distinct values whenever the next column would overflow it
+    key, radix = np.zeros(len(codes[0]), dtype=np.int64), 1
+    for col_codes, col_labels in zip(codes, labels):
+        if radix * len(col_labels) > 2 ** 62:
+            _, key = np.unique(key, return_inverse=True)
+            radix = int(key.max()) + 1 if len(key) else 1
+        key = key * len(col_labels) + col_codes
+        radix *= len(col_labels)
+    if radix <= 4 * max(len(key), 1):
+        present = np.flatnonzero(np.bincount(key, minlength=radix))
+        group_of_key = np.empty(radix, dtype=np.int64)
+        group_of_key[present] = np.arange(len(present))
+        groups = group_of_key[key]
+    else:
+        _, groups = np.unique(key, return_inverse=True)
+
+    # The group-by values of a group are those of its first row
+    n_groups = int(groups.max()) + 1 if len(groups) else 0
+    first = np.zeros(n_groups, dtype=np.int64)
+    first[groups[::-1]] = np.arange(len(groups) - 1, -1, -1)
+    return groups, {col: [col_labels[c] for c in col_codes[first]]
+                    for col, col_codes, col_labels in zip(group_by, codes, labels)}
+
+
+def _aggregate(frame: pd.DataFrame, positions: Optional[np.ndarray], groups: np.ndarray, n_groups: int,
+               agg: QueryAggregation) -> np.ndarray:
+    if agg.func == "count" and agg.column in (None, RECORD_COUNT):
+        return np.bincount(groups, minlength=n_groups)
+    values = _take(frame, agg.column, positions)
+    if agg.func == "count":
+        return np.bincount(groups, weights=np.asarray(values.notna()), minlength=n_groups).astype(np.int64)
+    if agg.func in ("sum", "mean"):
+        if not pd.api.types.is_numeric_dtype(values):
+            raise HTTPException(status_code=400, detail=f"Cannot {agg.func} non-numeric column '{agg.column}'")
+        if pd.api.types.is_integer_dtype(values) or pd.api.types.is_bool_dtype(values):
+            # Integer arithmetic: float64 weights would round totals past 2**53
+            dtype = np.uint64 if pd.api.types.is_unsigned_integer_dtype(values) else np.int64
+            present = np.asarray(values.notna())
+            sums = np.zeros(n_groups, dtype=dtype)
+            np.add.at(sums, groups, values.to_numpy(dtype=dtype, na_value=0))
+        else:
+            numbers = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            present = ~np.isnan(numbers)
+            sums = np.bincount(groups, weights=np.where(present, numbers, 0.0), minlength=n_groups)
+        if agg.func == "sum":
+            return sums
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return sums / np.bincount(groups, weights=present, minlength=n_groups)
+    grouped = pd.Series(values.to_numpy(), copy=False).groupby(groups)
+    try:
+        result = grouped.nunique() if agg.func == "nunique" else grouped.agg(agg.func)
+    except TypeError:
+        raise HTTPException(status_code=400, detail=f"Cannot {agg.func} column '{agg.column}'")
+    return result.reindex(range(n_groups)).to_numpy()
+
+
+def _aggregation_name(agg: QueryAggregation) -> str:
+    if agg.name:
+        return agg.name
+    return "count" if agg.func == "count" and agg.column is None else f"{agg.func}({agg.column})"
+
+
+def _sorted(table: pd.DataFrame, sort: List[QuerySort], limit: int) -> pd.DataFrame:
+    if sort:
+        _check_columns(table, [s.column for s in sort])
+        table = table.sort_values([s.column for s in sort], ascending=[not s.descending for s in sort],
+                                  kind="stable", na_position="last")
+    return table.head(limit)
+
+
+def _from_cube(dataset: LoadedDataset, query: QueryPayload, dims: list,
+               aggregations: List[QueryAggregation]) -> Optional[Tuple[pd.DataFrame, int, int]]:
+    """(table, matched rows, groups) from the rollup cube, or None if the query does not fit it."""
+    cube = dataset.cube
+    if cube is None or not aggregations:
+        return None
+    needs: Dict[str, List[str]] = {}
+    for agg in aggregations:
+        needs.setdefault(agg.column or RECORD_COUNT, []).append(agg.func)
+    if not cube.covers(dims + [f.column for f in query.filters], needs, RECORD_COUNT):
+        return None
+
+    where = None
+    for f in query.filters:
+        passing = _matches(cube.keys[f.column], f)
+        where = passing if where is None else where & passing
+    stats, sizes = cube.rollup(dims, where, dropna=False)
+    if not cube.within_tolerance(stats, [agg.column for agg in aggregations if agg.func in ("sum", "mean")]):
+        return None
+    table = {name: [_label(value) for value in stats.index.get_level_values(i)]
+             for i, name in enumerate(query.groupBy)}
+    for agg in aggregations:
+        if agg.column in (None, RECORD_COUNT):
+            values = sizes
+        else:
+            values = cube.value(stats, sizes, agg.column, agg.func)
+        table[_aggregation_name(agg)] = values.to_numpy()
+    return pd.DataFrame(table), int(sizes.sum()), len(sizes)
+
+
+def _from_rows(dataset: LoadedDataset, query: QueryPayload, aggregations: List[QueryAggregation],
+               timings: Timings, indexed: List[str]) -> Tuple[pd.DataFrame, int, int]:
+    """(table, matched rows, groups) from the rows, through the column indexes."""
+    frame = dataset.frame
+    with timings.stage("filter"):
+        positions = _select(dataset, query.filters, indexed)
+    matched = len(frame) if positions is None else len(positions)
+
+    with timings.stage("aggregate"):
+        if not aggregations:
+            table = frame[query.columns or list(frame.columns)]
+            return (table if positions is None else table.iloc[positions]), matched, 0
+        if query.groupBy:
+            groups, table = _group_codes(dataset, positions, query.groupBy, indexed)
+            n_groups = len(next(iter(table.values())))
+        else:
+            groups, table, n_groups = np.zeros(matched, dtype=np.int64), {}, 1
+        for agg in aggregations:
+            table[_aggregation_name(agg)] = _aggregate(frame, positions, groups, n_groups, agg)
+        return pd.DataFrame(table), matched, n_groups
+
+
+def run_query(path: str, body: bytes, max_datasets: int) -> Tuple[Dict[str, Any], Timings]:
+    """
+    Runs POST /query on the dataset stored at path (404 if none) and returns
+    the response content and stage timings. Loaded datasets are kept in
+    this process, up to max_datasets.
+
+    Group-bys and filters on the rollup cube's dimensions, with aggregations
+    it holds, are answered from the cube; everything else from the rows.
+    """
+    timings = Timings()
+    query = _parse_query(body)
+    with timings.stage("load"):
+        try:
+            dataset, loaded = loaded_dataset(path, max_datasets)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Unknown dataset")
+        except IngestError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    frame = dataset.frame
+    aggregations = query.aggregations
+    if query.groupBy and not aggregations:
+        aggregations = [QueryAggregation()]
+    dims = [parse_dimension(name) for name in query.groupBy]
+    date_columns = {c["name"] for c in dataset.analysis["columns"] if c["type"] == "date"}
+    for dim in dims:
+        if isinstance(dim, tuple) and dim[1] not in date_columns:
+            raise HTTPException(status_code=400, detail=f"month() needs a date column, '{dim[1]}' is not one")
+    named = [c for c in [f.column for f in query.filters] + [d for d in dims if not isinstance(d, tuple)]
+             + (query.columns or []) + [a.column for a in aggregations if a.column is not None] if c != RECORD_COUNT]
+    _check_columns(frame, named)
+    for agg in aggregations:
+        if agg.column is None and agg.func != "count":
+            raise HTTPException(status_code=400, detail=f"Aggregation '{agg.func}' needs a column")
+
+    indexed: List[str] = []
+    try:
+        with timings.stage("rollup"):
+            answer = _from_cube(dataset, query, dims, aggregations)
+        source = "cube" if answer is not None else "rows"
+        if answer is None:
+            answer = _from_rows(dataset, query, aggregations, timings, indexed)
+        table, matched, n_groups = answer
+
+        with timings.stage("sort"):
+            # Groups come sorted by their values unless asked otherwise
+            table = _sorted(table, query.sort or [QuerySort(column=name) for name in query.groupBy], query.limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Python engine crash: %s", e)
+        raise HTTPException(status_code=500, detail=f"Python Engine Error: {str(e)}")
+
+    result = {
+        "status": "success",
+        "projectType": dataset.project_type,
+        "columns": list(table.columns),
+        "rows": table.to_dict(orient="records"),
+        "metadata": {
+            "rowCount": len(frame),
+            "matchedRows": matched,
+            "returnedRows": len(table),
+            "truncated": len(table) < (n_groups if aggregations else matched),
+            "loaded": loaded,
+            "source": source,
+            "indexedColumns": list(dict.fromkeys(indexed)),
+        },
+    }
+    if aggregations:
+        result["metadata"]["groups"] = n_groups
+    if source == "cube":
+        # Float sums and means from the cube may differ from a scan of the rows by this much
+        result["metadata"]["relativeTolerance"] = SUM_TOLERANCE
+    return result, timings
@@ -0,0 +1,83 @@
+"""
+Registered datasets: stored once, then analyzed by id.
+
+A dataset is kept as an uncompressed Arrow IPC file. Analyses open it through
+a memory map, so the columns are views of the file's pages: no JSON parsing
+or frame building, no copy of numeric columns without nulls, and every worker
+process mapping the file shares the same pages through the OS page cache.
+(Parquet would need decoding on every read, so it is not used here.)
+"""
+import os
+from typing import Any, Dict, Tuple
+
+import pandas as pd
+
+from ingest import IngestError
+
+
+def dataset_path(registry_dir: str, dataset_id: str) -> str:
+    return os.path.join(registry_dir, f"{dataset_id}.arrow")
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise IngestError("The dataset registry requires the 'pyarrow' package")
+    return pa
+
+
+def _arrow_column(pa, values: pd.Series):
+    try:
+        # from_pandas=False keeps float NaN as NaN (not null), so the column
+        # maps back into pandas without a copy
+        return pa.array(values, from_pandas=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed value types in one column (e.g. numbers and text from JSON)
+        return pa.array(values.astype(str).where(values.notna()), type=pa.string(), from_pandas=True)
+
+
+def store_frame(path: str, df: pd.DataFrame, project_type: str):
+    """Writes df (with its projectType) to path."""
+    pa = _pyarrow()
+    table = pa.table({col: _arrow_column(pa, df[col]) for col in df.columns},
+                     metadata={"projectType": project_type})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)  # atomic, so readers never see a partial file
+
+
+def load_frame(path: str) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """
+    The stored frame, memory-mapped, and its schema metadata. Raises
+    FileNotFoundError if the dataset is not registered.
+    """
+    pa = _pyarrow()
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    metadata = {k.decode("utf-8"): v.decode("utf-8") for k, v in (table.schema.metadata or {}).items()}
+    return table.to_pandas(split_blocks=True), metadata
+
+
+def dataset_info(path: str) -> Dict[str, Any]:
+    """projectType, shape and file size of a stored dataset, read without loading its columns."""
+    pa = _pyarrow()
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    metadata = table.schema.metadata or {}
+    return {
+        "projectType": metadata.get(b"projectType", b"general").decode("utf-8"),
+        "rows": table.num_rows,
+        "columns": table.num_columns,
+        "bytes": os.path.getsize(path),
+    }
+
+
+def delete_dataset(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,174 @@
+"""
+Rollup cube of a loaded dataset: sum, count, min and max of every numeric
+column (and the row count) per combination of the dimensions the dashboards
+slice by, the month of each date column and the categorical columns.
+
+It is built once when a registered dataset is loaded (see query.py). Any
+group-by on a subset of its dimensions, and any whole-dataset total, is then
+re-aggregated from the cells instead of the rows: counts add up, min and max
+of the cells' min and max, sums add up and means are sum / count.
+
+Sums and means of integer columns are exact, the numbers the rows give. Float
+sums are compensated per cell and again when the cells are added up: their
+error is at most a few units of rounding times the sum of the values'
+magnitudes (which the cells also hold), as is that of pandas' compensated
+(grouped) and pairwise (whole-column) sums over the rows, so the two can
+differ in the last digits. A rollup answers float sums and means only where
+that bound keeps them within SUM_TOLERANCE (relative) of the exact ones,
+which holds unless a group's values cancel to near zero; otherwise the
+caller falls back to the rows (see within_tolerance). Dimensions are
+added (months first, then categoricals by decreasing cardinality) only while
+the cube stays much smaller than the rows, so it never costs more to read
+than what it replaces.
+"""
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dates import DateCache
+
+# What the cells hold per numeric column
+CELL_FUNCS = ["sum", "count", "min", "max"]
+
+# Aggregations answered from the cells
+CUBE_FUNCS = {"sum", "count", "size", "mean", "min", "max"}
+
+# Integer sums past this are rounded by the float64 sums of the row path
+EXACT_SUM_LIMIT = 2 ** 53
+
+# Largest relative error of a float sum (or mean) answered from the cells
+SUM_TOLERANCE = 1e-12
+
+# Unit roundoff of float64
+_UNIT_ROUNDOFF = np.finfo(np.float64).eps / 2
+
+# At most this many cells, and at most this share of the rows
+MAX_CELLS = 100_000
+MAX_CELL_SHARE = 0.1
+
+
+def month_key(column: str) -> Tuple[str, str]:
+    """The dimension (and AggregationPlan key) of a date column's month."""
+    return ("month", column)
+
+
+def dimension_name(dim: Hashable) -> str:
+    """How a dimension is named in responses and queries: the column, or "month(<column>)"."""
+    return f"month({dim[1]})" if isinstance(dim, tuple) else str(dim)
+
+
+def parse_dimension(name: str) -> Hashable:
+    return month_key(name[len("month("):-1]) if name.startswith("month(") and name.endswith(")") else name
+
+
+class RollupCube:
+    def __init__(self, dims: List[Hashable], keys: Dict[Hashable, pd.Series], sizes: np.ndarray,
+                 cells: pd.DataFrame):
+        self.dims = dims
+        self.keys = keys  # per dimension, its value in each cell
+        self.sizes = sizes  # rows per cell
+        self.cells = cells  # (column, func) per cell
+        self.measures = set(cells.columns.get_level_values(0))
+        # Measures whose sums (and means) the cells give exactly (integers) or
+        # with a rounding error bound (floats, which hold their sum of magnitudes)
+        rows = int(sizes.sum())
+        self.summable = {column for column in self.measures if (column, "abs") in cells.columns}
+        for column in self.measures - self.summable:
+            if pd.api.types.is_integer_dtype(cells[(column, "sum")]):
+                low, high = cells[(column, "min")].min(), cells[(column, "max")].max()
+                if max(abs(int(low)), abs(int(high))) * rows < EXACT_SUM_LIMIT:
+                    self.summable.add(column)
+        # Error of a float sum from the cells, or from a compensated or pairwise
+        # row scan, per unit of the sum of magnitudes
+        self.rounding = (np.log2(max(rows, 2)) + 6) * _UNIT_ROUNDOFF
+
+    @property
+    def cell_count(self) -> int:
+        return len(self.sizes)
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, analysis, date_cache: DateCache) -> Optional["RollupCube"]:
+        """The cube of a profiled frame, or None if no dimension keeps it small enough."""
+        rows = len(df)
+        budget = min(MAX_CELLS, int(rows * MAX_CELL_SHARE))
+        info = [c for c in analysis["columns"] if c["name"] in df.columns]
+        candidates = [(month_key(c["name"]), lambda c=c: date_cache.parsed(df, c["name"]).dt.to_period("M"))
+                      for c in info if c["type"] == "date"]
+        candidates += [(c["name"], lambda c=c: df[c["name"]])
+                       for c in sorted(info, key=lambda c: -c["unique_count"]) if c["is_categorical"]]
+
+        # Cell number of every row, refined one accepted dimension at a time
+        cell, cell_count = np.zeros(rows, dtype=np.int64), 1
+        dims, values = [], {}
+        for dim, get_values in candidates:
+            dim_values = get_values()
+            codes, uniques = pd.factorize(dim_values)
+            refined, refined_uniques = pd.factorize(cell * (len(uniques) + 1) + codes + 1)
+            if len(refined_uniques) > budget:
+                continue
+            cell, cell_count = refined, len(refined_uniques)
+            dims.append(dim)
+            values[dim] = dim_values
+        if not dims:
+            return None
+
+        measures = [c["name"] for c in info if c["type"] == "numeric"]
+        cells = df[measures].groupby(cell, sort=True).agg(CELL_FUNCS) if measures else \
+            pd.DataFrame(index=pd.RangeIndex(cell_count), columns=pd.MultiIndex.from_tuples([], names=[None, None]))
+        floats = [column for column in measures if pd.api.types.is_float_dtype(df[column])]
+        if floats:
+            magnitudes = df[floats].abs().groupby(cell, sort=True).sum()
+            magnitudes.columns = pd.MultiIndex.from_tuples([(column, "abs") for column in floats])
+            cells = pd.concat([cells, magnitudes], axis=1)
+        first = np.zeros(cell_count, dtype=np.int64)
+        first[cell[::-1]] = np.arange(rows - 1, -1, -1)
+        keys = {dim: values[dim].iloc[first].reset_index(drop=True).rename(dim) for dim in dims}
+        return cls(dims, keys, np.bincount(cell, minlength=cell_count), cells.reset_index(drop=True))
+
+    def covers(self, dims: List[Hashable], columns: Dict[str, List[str]], count_column: Optional[str] = None) -> bool:
+        """Whether funcs of columns ({column: [func]}) grouped by dims can come from the cube."""
+        return all(dim in self.dims for dim in dims) and all(
+            all(f in CUBE_FUNCS and (column == count_column or self._serves(column, f)) for f in funcs)
+            for column, funcs in columns.items())
+
+    def _serves(self, column: str, func: str) -> bool:
+        return column in (self.summable if func in ("sum", "mean") else self.measures)
+
+    def rollup(self, dims: List[Hashable], where: Optional[np.ndarray] = None,
+               dropna: bool = True) -> Tuple[pd.DataFrame, pd.Series]:
+        """
+        The cell statistics summed up per group of dims (sorted by their values;
+        no dims: one group of everything), and the rows per group. where
+        selects cells.
+        """
+        cells, sizes = self.cells, pd.Series(self.sizes)
+        if where is not None:
+            cells, sizes = cells[where], sizes[where]
+        added = [c for c in cells.columns if c[1] in ("sum", "count", "abs")]
+        lowest = [c for c in cells.columns if c[1] == "min"]
+        highest = [c for c in cells.columns if c[1] == "max"]
+        if not dims:
+            stats = pd.concat([cells[added].sum(), cells[lowest].min(), cells[highest].max()]).to_frame().T
+            return stats[list(cells.columns)], pd.Series([int(sizes.sum())])
+        keys = [self.keys[dim] if where is None else self.keys[dim][where] for dim in dims]
+        grouped = cells.groupby(keys, sort=True, dropna=dropna)
+        stats = pd.concat([grouped[added].sum(), grouped[lowest].min(), grouped[highest].max()], axis=1)
+        return stats[list(cells.columns)], sizes.groupby(keys, sort=True, dropna=dropna).sum()
+
+    def within_tolerance(self, stats: pd.DataFrame, columns) -> bool:
+        """Whether the float sums of columns in a rollup() are within SUM_TOLERANCE of the exact ones."""
+        for column in columns:
+            if (column, "abs") in stats.columns:
+                bound = self.rounding * stats[(column, "abs")].to_numpy()
+                if np.any(bound > SUM_TOLERANCE * np.abs(stats[(column, "sum")].to_numpy())):
+                    return False
+        return True
+
+    def value(self, stats: pd.DataFrame, sizes: pd.Series, column: str, func: str) -> pd.Series:
+        """func of a measure per group of a rollup()."""
+        if func == "size":
+            return sizes
+        if func == "mean":
+            return stats[(column, "sum")] / stats[(column, "count")]
+        return stats[(column, func)]
@@ -0,0 +1,81 @@
+"""
+Point samples for scatter charts.
+
+Every row gets one random key per request, drawn from a seeded generator, and
+a sample is the rows with the smallest keys. All charts of a request pick from
+the same keys, so the samples are reproducible (same data + seed -> same
+points) and consistent with each other. Stratified samples reserve part of the
+sample for every group, so rare groups are not lost to a uniform draw.
+"""
+from typing import Dict, Hashable, Optional
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SEED = 0
+
+# Points per chart when the request does not set a sample size
+SCATTER_POINTS = 100
+GROUPED_SCATTER_POINTS = 300
+
+
+def stratified_positions(keys: np.ndarray, codes: np.ndarray, n: int) -> np.ndarray:
+    """
+    Sorted positions of the n rows picked by smallest key, stratified by
+    codes: half of the sample is split equally between the strata (code >= 0;
+    a stratum with fewer rows gives all of them), then the smallest remaining
+    keys fill the rest, roughly in proportion to stratum size. Rows with
+    code -1 (no group) are never picked.
+    """
+    valid = np.flatnonzero(codes >= 0)
+    if len(valid) <= n:
+        return valid
+    keys, codes = keys[valid], codes[valid]
+
+    order = np.lexsort((keys, codes))
+    sorted_codes = codes[order]
+    # Rank of each row by key within its stratum
+    rank = np.arange(len(order)) - np.searchsorted(sorted_codes, sorted_codes, side="left")
+    strata = int(np.count_nonzero(np.diff(sorted_codes))) + 1
+    chosen = rank < n // (2 * strata)
+
+    extra = n - int(np.count_nonzero(chosen))
+    if extra > 0:
+        rest = np.flatnonzero(~chosen)
+        rest_keys = keys[order[rest]]
+        chosen[rest[np.argpartition(rest_keys, extra - 1)[:extra]]] = True
+    return np.sort(valid[order[chosen]])
+
+
+class RowSampler:
+    """
+    The per-request sampler shared by all charts. size overrides each chart's
+    default number of points.
+    """
+
+    def __init__(self, size: Optional[int] = None, seed: int = DEFAULT_SEED):
+        self.size = size
+        self.seed = seed
+        self._keys: Optional[np.ndarray] = None
+        self._positions: Dict[Hashable, np.ndarray] = {}
+
+    def keys(self, n_rows: int) -> np.ndarray:
+        # Drawn once, on first use, so requests without point charts skip it
+        if self._keys is None:
+            self._keys = np.random.default_rng(self.seed).random(n_rows)
+        return self._keys
+
+    def sample(self, frame: pd.DataFrame, default_size: int, group_col: Optional[str] = None) -> pd.DataFrame:
+        """Rows of frame (in frame order), stratified by group_col if given."""
+        n = self.size or default_size
+        cache_key = (group_col, n)
+        positions = self._positions.get(cache_key)
+        if positions is None:
+            keys = self.keys(len(frame))
+            if group_col is None:
+                positions = np.sort(np.argpartition(keys, n - 1)[:n]) if n < len(keys) else np.arange(len(keys))
+            else:
+                codes, _ = pd.factorize(frame[group_col])
+                positions = stratified_positions(keys, codes, n)
+            self._positions[cache_key] = positions
+        return frame.iloc[positions]
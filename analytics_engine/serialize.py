@@ -0,0 +1,137 @@
+"""
+Encoding of analysis responses.
+
+Results are encoded with orjson when it is installed: it writes numpy and
+Python values straight to UTF-8 bytes, without the jsonable_encoder pass and
+stdlib json walk (the fallback). Non-finite floats (NaN, inf) become null
+with either encoder.
+
+Optional output shaping, chosen per request:
+- layout="columns": chart data as {column: [values]} instead of one record
+  per point, so key names are not repeated in every record
+- precision=N: floats rounded to N significant digits
+
+Responses are compressed with zstd (if the zstandard package is installed)
+or gzip when the client accepts it.
+"""
+import datetime
+import gzip
+import json
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+LAYOUTS = ("records", "columns")
+
+# Bodies smaller than this are sent uncompressed (not worth the CPU)
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+
+def _default(value):
+    # Values orjson does not encode itself, encoded as jsonable_encoder would
+    if isinstance(value, (pd.Timestamp, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is pd.NA or value is pd.NaT:
+        return None
+    return jsonable_encoder(value)
+
+
+def _round(value, digits: int):
+    if isinstance(value, float):
+        if not math.isfinite(value) or value == 0:
+            return value
+        return round(value, digits - 1 - int(math.floor(math.log10(abs(value)))))
+    if isinstance(value, dict):
+        return {k: _round(v, digits) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_round(v, digits) for v in value]
+    return value
+
+
+def _finite(value):
+    # null for NaN and inf, as orjson writes them; numpy values as Python ones
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: _finite(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(v) for v in value]
+    if isinstance(value, (np.generic, np.ndarray)):
+        return _finite(value.tolist())
+    return value
+
+
+def _columns(records: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    names: Dict[str, None] = {}
+    for record in records:
+        names.update(dict.fromkeys(record))
+    return {name: [record.get(name) for record in records] for name in names}
+
+
+def shape_result(result: Dict[str, Any], layout: str = "records", precision: Optional[int] = None) -> Dict[str, Any]:
+    """result with the chart data layout and float precision applied (a new dict if anything changes)."""
+    if layout == "columns" and result.get("charts"):
+        charts = []
+        for chart in result["charts"]:
+            data = chart.get("data")
+            if isinstance(data, list) and all(isinstance(r, dict) for r in data):
+                chart = {**chart, "data": _columns(data), "layout": "columns"}
+            charts.append(chart)
+        result = {**result, "charts": charts}
+    if precision is not None:
+        result = _round(result, precision)
+    return result
+
+
+def encode_result(result: Dict[str, Any], layout: str = "records", precision: Optional[int] = None) -> bytes:
+    result = shape_result(result, layout, precision)
+    if orjson is not None:
+        return orjson.dumps(result, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    # Same bytes Starlette's JSONResponse renders (which would reject NaN/inf)
+    return json.dumps(jsonable_encoder(_finite(result)), ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def _accepted(accept_encoding: str) -> Dict[str, float]:
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name] = q
+    return accepted
+
+
+def compress(body: bytes, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+    """body compressed with the best encoding the Accept-Encoding header allows, and its name (None: identity)."""
+    if len(body) < MIN_COMPRESS_BYTES or not accept_encoding:
+        return body, None
+    accepted = _accepted(accept_encoding)
+    if zstandard is not None and accepted.get("zstd", 0) > 0:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body), "zstd"
+    if accepted.get("gzip", accepted.get("*", 0)) > 0:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), "gzip"
+    return body, None
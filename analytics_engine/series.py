@@ -0,0 +1,106 @@
+"""
+Line / area chart series: time bucketing and downsampling.
+
+Date series are aggregated per day first (cheap to group and to merge across
+chunks), then rolled up to the finest granularity (day, week, month) whose
+timeline fits in LINE_POINTS buckets. Series that are still longer (numeric X,
+or many years of months) are downsampled with Largest-Triangle-Three-Buckets,
+which keeps the points that shape the curve instead of cutting off its tail.
+"""
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Target number of points per line / area chart
+LINE_POINTS = 100
+
+# Finest first: name -> (period frequency, label format of the period start)
+GRANULARITIES = {
+    "day": ("D", "%d %b %Y"),
+    "week": ("W", "%d %b %Y"),
+    "month": ("M", "%b %Y"),
+}
+
+
+def lttb(x: np.ndarray, y: np.ndarray, target: int) -> np.ndarray:
+    """
+    Positions of the points Largest-Triangle-Three-Buckets keeps from a series
+    sorted by x: the first and last points, and from each of target - 2 equal
+    buckets in between the point making the largest triangle with the point
+    kept before it and the mean of the next bucket.
+    """
+    n = len(x)
+    if target >= n or target < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+
+    edges = np.linspace(1, n - 1, target - 1).astype(np.intp)
+    keep = np.empty(target, dtype=np.intp)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(target - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def choose_granularity(days: pd.PeriodIndex, target: int = LINE_POINTS) -> str:
+    """
+    The finest granularity whose timeline (first to last bucket) has at most
+    target buckets, skipping any that shows no more distinct points than the
+    next coarser one (e.g. monthly data stays monthly).
+    """
+    if len(days) == 0:
+        return "month"
+    names = list(GRANULARITIES)
+    distinct = {name: days.asfreq(GRANULARITIES[name][0]).unique() for name in names}
+    for i, name in enumerate(names[:-1]):
+        buckets = distinct[name]
+        span = buckets.max().ordinal - buckets.min().ordinal + 1
+        if span <= target and len(buckets) > len(distinct[names[i + 1]]):
+            return name
+    return names[-1]
+
+
+def _downsample(chart, values: pd.Series, x) -> pd.Series:
+    keep = lttb(x, values.to_numpy(dtype=np.float64, na_value=np.nan), LINE_POINTS)
+    if len(keep) < len(values):
+        chart["downsampled"] = {"method": "lttb", "from": len(values)}
+        values = values.iloc[keep]
+    return values
+
+
+def fill_date_line(chart, daily: Optional[pd.Series]):
+    """chart["data"] from per-day totals of y (a Series indexed by daily Periods)."""
+    x_col, y_col = chart["x"], chart["y"]
+    if daily is None or daily.empty:
+        chart["data"] = []
+        return
+    daily = daily.sort_index()
+    granularity = choose_granularity(daily.index)
+    freq, label = GRANULARITIES[granularity]
+    totals = daily if freq == "D" else daily.groupby(daily.index.asfreq(freq)).sum()
+    totals = _downsample(chart, totals, totals.index.asi8)
+
+    chart["granularity"] = granularity
+    starts = totals.index.start_time.strftime(label)
+    chart["data"] = [{x_col: start, y_col: value} for start, value in zip(starts, totals.tolist())]
+
+
+def fill_numeric_line(chart, means: Optional[pd.Series]):
+    """chart["data"] from the mean of y per numeric x value."""
+    x_col, y_col = chart["x"], chart["y"]
+    if means is None or means.empty:
+        chart["data"] = []
+        return
+    means = means.sort_index()
+    means = _downsample(chart, means, means.index.to_numpy(dtype=np.float64))
+    chart["data"] = means.rename_axis(x_col).reset_index(name=y_col).to_dict(orient="records")
@@ -0,0 +1,644 @@
+"""
+Out-of-core analysis for CSV files that are too large to load as one DataFrame
+(and for /analyze bodies over the memory budget, see admission.py).
+
+The file is read twice in fixed-size chunks:
+1. Profiling pass: per-column type, unique/null counts and min/max/mean are
+   accumulated chunk by chunk and turned into the same analysis["columns"]
+   entries analyze_dataframe produces, along with the sums behind the
+   correlation matrix of the numeric columns.
+2. Aggregation pass: recommend_charts runs on that profile (KPIs are answered
+   from it directly), then every chart's aggregation (groupby sum/mean,
+   date line series, histogram bins, samples, box plot statistics) is
+   built incrementally from partial results.
+
+Peak memory is bounded by the chunk size plus the partial aggregates, which are
+sized by the number of groups rather than the number of rows. Unique counts are
+exact up to EXACT_UNIQUE_LIMIT distinct values per column; a column with more
+(an id, free text) moves to a HyperLogLog sketch and its count is reported with
+its error bound, as in the approximate mode.
+
+With approximate=True every unique count comes from a HyperLogLog sketch and
+box plot quartiles from KLL sketches built per chunk and merged, each reported
+with its error bound.
+"""
+import copy
+import numpy as np
+import pandas as pd
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from analyzer import column_info, has_id_name
+from chart_data import fill_group_series, fill_kpis, group_comparison_rows, histogram_rows
+from chart_recommender import recommend_charts
+from correlation import CorrelationMoments, correlation_columns
+from dates import DATE_MIN_RATIO, guess_format, parse_dates, sample_date_hits
+from ingest import RECORD_COUNT, make_unique_columns
+from metrics import Timings
+from sampling import DEFAULT_SEED, GROUPED_SCATTER_POINTS, SCATTER_POINTS, stratified_positions
+from series import fill_date_line, fill_numeric_line
+from sketches import HyperLogLog, KLLSketch, describe_sketches
+
+DEFAULT_CHUNK_SIZE = 50_000
+
+# Distinct values kept per column for an exact unique count; past it the
+# column's count comes from a HyperLogLog sketch
+EXACT_UNIQUE_LIMIT = 100_000
+
+# Values kept per category to estimate box plot quartiles; categories with at
+# most this many rows get exact quartiles.
+BOX_PLOT_SAMPLE_SIZE = 10_000
+
+
+def _normalize_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Clean column names, and the Record Count column of 1s."""
+    chunk.columns = make_unique_columns([str(c) for c in chunk.columns])
+    if RECORD_COUNT not in chunk.columns:
+        chunk[RECORD_COUNT] = 1
+    return chunk
+
+
+def _read_chunks(source, chunk_size: int):
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return pd.read_csv(source, chunksize=chunk_size, encoding="utf-8-sig")
+
+
+def _merge_sum(acc, partial):
+    """Adds partial groupby sums/counts into the running total (aligned on group key)."""
+    if acc is None:
+        return partial
+    return pd.concat([acc, partial]).groupby(level=0).sum()
+
+
+class _ColumnProfile:
+    """Running statistics for one column across chunks."""
+
+    def __init__(self, name: str, approximate: bool = False):
+        self.name = name
+        self.approximate = approximate
+        self.is_numeric = True
+        self.is_integer = True
+        self.is_datetime = True
+        self.date_format = None
+        self.date_format_guessed = False
+        self.date_hits = 0
+        self.date_sampled = 0
+        self.uniques: set = set()
+        self.numeric_uniques: set = set()
+        self.sketch = HyperLogLog() if approximate else None
+        self.null_count = 0
+        self.non_null_count = 0
+        self.sum = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def update(self, col_data: pd.Series):
+        is_numeric = pd.api.types.is_numeric_dtype(col_data)
+        self.is_numeric = self.is_numeric and is_numeric
+        self.is_integer = self.is_integer and pd.api.types.is_integer_dtype(col_data)
+        self.is_datetime = self.is_datetime and pd.api.types.is_datetime64_any_dtype(col_data)
+
+        non_null = col_data.dropna()
+        self.null_count += len(col_data) - len(non_null)
+        self.non_null_count += len(non_null)
+        if self.sketch is not None:
+            # A value seen as a number in one chunk and as text in another is
+            # counted twice here, unlike in the exact count.
+            self.sketch.update(non_null)
+        else:
+            (self.numeric_uniques if is_numeric else self.uniques).update(non_null.unique().tolist())
+            if len(self.uniques) + len(self.numeric_uniques) > EXACT_UNIQUE_LIMIT:
+                self._to_sketch()
+
+        if is_numeric:
+            if not non_null.empty:
+                self.sum += non_null.sum()
+                self.count += len(non_null)
+                chunk_min, chunk_max = non_null.min(), non_null.max()
+                self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+                self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+        elif not pd.api.types.is_datetime64_any_dtype(col_data):
+            # Try to parse as date if it's a string: sample every chunk with the
+            # format guessed from the first non-null value seen
+            if not self.date_format_guessed and non_null.size:
+                self.date_format = guess_format(non_null)
+                self.date_format_guessed = True
+            hits, sampled = sample_date_hits(col_data, self.date_format)
+            self.date_hits += hits
+            self.date_sampled += sampled
+
+    def _to_sketch(self):
+        """Moves the distinct values kept so far into a HyperLogLog sketch."""
+        self.sketch = HyperLogLog()
+        for values in (self.uniques, self.numeric_uniques):
+            if values:
+                self.sketch.update(pd.Series(list(values)))
+        self.uniques, self.numeric_uniques = set(), set()
+
+    @property
+    def sketched(self) -> bool:
+        """Whether unique_count() is an estimate."""
+        return self.sketch is not None
+
+    def mean(self):
+        return self.sum / self.count if self.count else float("nan")
+
+    def unique_count(self) -> int:
+        if self.sketch is not None:
+            return min(self.sketch.estimate(), self.non_null_count)
+        if not self.uniques:
+            return len(self.numeric_uniques)
+        if not self.numeric_uniques:
+            return len(self.uniques)
+        # Column is numeric in some chunks and text in others; a whole-file read
+        # would keep it as text, so compare the numbers in their text form.
+        as_text = {str(int(v)) if float(v).is_integer() else repr(float(v)) for v in self.numeric_uniques}
+        return len(self.uniques | as_text)
+
+    def unique_count_error(self) -> Optional[int]:
+        """Error bound of unique_count() (~95% confidence); None when it is exact."""
+        return self.sketch.error_bound() if self.sketch is not None else None
+
+    def info(self, row_count: int) -> Dict[str, Any]:
+        unique_count = self.unique_count()
+        unique_error = self.unique_count_error()
+        all_unique = unique_count == row_count if unique_error is None else row_count - unique_count <= unique_error
+        dtype = "string"
+        if self.is_numeric:
+            if self.is_integer and all_unique and has_id_name(self.name):
+                dtype = "id"
+            else:
+                dtype = "numeric"
+        elif self.is_datetime or (self.date_sampled > 0 and self.date_hits > self.date_sampled * DATE_MIN_RATIO):
+            dtype = "date"
+
+        stats = (self.min, self.max, self.mean()) if self.count else None
+        info = column_info(self.name, dtype, unique_count, self.null_count, row_count, stats)
+        if unique_error is not None:
+            info["unique_count_error"] = unique_error
+        return info
+
+
+# --- Chart aggregations ---
+# Each accumulator consumes chunks through update() and writes the final
+# chart["data"] (same layout as the in-memory builders in chart_data) in finish().
+
+class _GroupAggregate:
+    """bar / pie / treemap: groupby x -> sum (or mean) of y, top 10."""
+
+    def __init__(self, chart):
+        self.x_col = chart.get("x") or chart.get("nameKey")
+        self.y_col = chart.get("y") or chart.get("dataKey")
+        self.agg_func = "mean" if chart.get("agg_type") == "mean" else "sum"
+        self.totals = None
+
+    def update(self, chunk):
+        grouped = chunk.groupby(self.x_col)[self.y_col]
+        partial = pd.DataFrame({"sum": grouped.sum(), "count": grouped.count()})
+        self.totals = _merge_sum(self.totals, partial)
+
+    def finish(self, chart):
+        if self.totals is None:
+            chart["data"] = []
+            return
+        values = self.totals["sum"] if self.agg_func == "sum" else self.totals["sum"] / self.totals["count"]
+        values = values.sort_index()
+        if self.x_col == self.y_col:
+            # Collision avoidance: grouping by X and aggregating X
+            agg_df = values.rename_axis(self.x_col).reset_index(name="value")
+            chart["y"] = "value"
+        else:
+            agg_df = values.rename_axis(self.x_col).reset_index(name=self.y_col)
+        agg_df = agg_df.sort_values(by=chart["y"], ascending=False).head(10) # Top 10
+        chart["data"] = agg_df.to_dict(orient="records")
+
+
+class _GroupMeans:
+    """radar_mean / multi_bar_mean: mean of each metric per group_col value."""
+
+    def __init__(self, chart):
+        self.group_col = chart.get("group_col")
+        self.metrics = chart.get("metrics")
+        self.sums = None
+        self.counts = None
+
+    def update(self, chunk):
+        grouped = chunk.groupby(self.group_col)[self.metrics]
+        self.sums = _merge_sum(self.sums, grouped.sum())
+        self.counts = _merge_sum(self.counts, grouped.count())
+
+    def finish(self, chart):
+        if self.sums is None:
+            return
+        means = (self.sums / self.counts).sort_index()
+        chart["data"] = group_comparison_rows(means, chart.get("x"))
+
+
+class _Histogram:
+    """
+    histogram: 10 equal-width bins between the profiled min and max, or in
+    approximate mode between the min and max seen so far (bin counts from a
+    KLL sketch, so rows appended later that widen the range are still counted).
+    """
+
+    def __init__(self, chart, profiles, approximate=False):
+        profile = profiles[chart["metric"]]
+        self.metric = chart["metric"]
+        self.bins = chart.get("bins", 10)
+        self.sketch = KLLSketch() if approximate else None
+        self.edges = np.linspace(profile.min, profile.max, self.bins + 1)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+
+    def update(self, chunk):
+        if self.sketch is not None:
+            self.sketch.update(chunk[self.metric])
+            return
+        counts, _ = np.histogram(chunk[self.metric].dropna(), bins=self.edges)
+        self.counts += counts
+
+    def finish(self, chart):
+        if self.sketch is not None:
+            sketch = self.sketch
+            bins = np.histogram_bin_edges([sketch.min, sketch.max] if sketch.count else [], bins=self.bins)
+            chart["data"] = histogram_rows(sketch.histogram(bins), bins, sketch.count_error())
+            return
+        chart["data"] = histogram_rows(self.counts, self.edges)
+
+
+class _NumericLine:
+    """line / area with numeric X: mean of y per x value, downsampled (see series.py)."""
+
+    def __init__(self, chart):
+        self.x_col = chart["x"]
+        self.y_col = chart["y"]
+        self.totals = None
+
+    def update(self, chunk):
+        grouped = chunk.groupby(self.x_col)[self.y_col]
+        self.totals = _merge_sum(self.totals, pd.DataFrame({"sum": grouped.sum(), "count": grouped.count()}))
+
+    def finish(self, chart):
+        means = self.totals["sum"] / self.totals["count"] if self.totals is not None else None
+        fill_numeric_line(chart, means)
+
+
+class _DateLine:
+    """
+    line / area with a date X: sum of y per day, rolled up to the chart's
+    granularity (day / week / month) in finish().
+    """
+
+    def __init__(self, chart, profiles):
+        self.x_col = chart["x"]
+        self.y_col = chart["y"]
+        x_profile = profiles.get(self.x_col)
+        self.date_format = x_profile.date_format if x_profile is not None else None
+        self.totals = None
+
+    def update(self, chunk):
+        days = parse_dates(chunk[self.x_col], self.date_format).dt.to_period("D")
+        self.totals = _merge_sum(self.totals, chunk[self.y_col].groupby(days).sum())
+
+    def finish(self, chart):
+        fill_date_line(chart, self.totals)
+
+
+class _Reservoir:
+    """
+    Uniform sample of n rows without replacement: every row gets a random key
+    and the n smallest keys seen so far are kept.
+    """
+
+    def __init__(self, columns: List[str], n: int, rng):
+        self.columns = columns
+        self.n = n
+        self.rng = rng
+        self.sample = None
+
+    def update(self, chunk):
+        part = chunk[self.columns].copy()
+        part["_key"] = self.rng.random(len(part))
+        if self.sample is not None:
+            part = pd.concat([self.sample, part], ignore_index=True)
+        self.sample = part.nsmallest(self.n, "_key")
+
+    def rows(self) -> pd.DataFrame:
+        if self.sample is None:
+            return pd.DataFrame(columns=self.columns)
+        return self.sample.drop(columns=["_key"])
+
+
+class _Scatter(_Reservoir):
+    """scatter: 100 sampled (x, y) points."""
+
+    def __init__(self, chart, rng, sample_size=None):
+        super().__init__([chart["x"], chart["y"]], sample_size or SCATTER_POINTS, rng)
+
+    def finish(self, chart):
+        chart["data"] = self.rows().to_dict(orient="records")
+
+
+class _GroupedScatter(_Reservoir):
+    """
+    scatter_group: 300 sampled points split into one series per group value,
+    stratified like sampling.RowSampler. Keeping the n smallest keys of each
+    group is enough to make the same picks at the end.
+    """
+
+    def __init__(self, chart, rng, sample_size=None):
+        self.x_col = chart["x"]
+        self.y_col = chart["y"]
+        self.group_col = chart["group_col"]
+        super().__init__(list(dict.fromkeys([self.x_col, self.y_col, self.group_col])),
+                         sample_size or GROUPED_SCATTER_POINTS, rng)
+
+    def update(self, chunk):
+        part = chunk[self.columns].copy()
+        part["_key"] = self.rng.random(len(part))
+        if self.sample is not None:
+            part = pd.concat([self.sample, part], ignore_index=True)
+        # Rows without a group value are never plotted
+        self.sample = part.sort_values("_key").groupby(self.group_col).head(self.n)
+
+    def rows(self) -> pd.DataFrame:
+        if self.sample is None:
+            return pd.DataFrame(columns=self.columns)
+        codes, _ = pd.factorize(self.sample[self.group_col])
+        positions = stratified_positions(self.sample["_key"].to_numpy(), codes, self.n)
+        return self.sample.iloc[positions].drop(columns=["_key"])
+
+    def finish(self, chart):
+        fill_group_series(chart, self.rows(), self.x_col, self.y_col, self.group_col)
+
+
+class _BoxPlot:
+    """
+    boxPlot: exact min/max/count per category; quartiles from a per-category
+    sample of BOX_PLOT_SAMPLE_SIZE values (exact for smaller categories), or
+    in approximate mode from per-category KLL sketches merged across chunks.
+    """
+
+    def __init__(self, chart, rng, approximate=False):
+        self.x_col = chart.get("x")
+        self.y_col = chart.get("y")
+        self.rng = rng
+        self.approximate = approximate
+        self.extremes = None
+        self.sample = None
+        self.sketches: Dict[Any, KLLSketch] = {}
+
+    def update(self, chunk):
+        tmp = chunk[[self.x_col, self.y_col]].copy()
+        tmp[self.y_col] = pd.to_numeric(tmp[self.y_col], errors="coerce")
+        tmp = tmp.dropna(subset=[self.x_col, self.y_col])
+        if tmp.empty:
+            return
+
+        grouped = tmp.groupby(self.x_col)[self.y_col]
+        partial = pd.DataFrame({"min": grouped.min(), "max": grouped.max(), "count": grouped.count()})
+        if self.extremes is None:
+            self.extremes = partial
+        else:
+            both = pd.concat([self.extremes, partial]).groupby(level=0)
+            self.extremes = pd.DataFrame({"min": both["min"].min(), "max": both["max"].max(), "count": both["count"].sum()})
+
+        if self.approximate:
+            for category, values in grouped:
+                partial = KLLSketch(seed=self.rng.integers(1 << 32))
+                partial.update(values)
+                if category in self.sketches:
+                    self.sketches[category].merge(partial)
+                else:
+                    self.sketches[category] = partial
+            return
+
+        tmp["_key"] = self.rng.random(len(tmp))
+        if self.sample is not None:
+            tmp = pd.concat([self.sample, tmp], ignore_index=True)
+        self.sample = tmp.sort_values("_key").groupby(self.x_col).head(BOX_PLOT_SAMPLE_SIZE)
+
+    def finish(self, chart):
+        if self.extremes is None:
+            return
+        if self.approximate:
+            quartiles = pd.DataFrame(
+                [sketch.quantiles([0.25, 0.5, 0.75]) + [round(sketch.rank_error, 6)] for sketch in self.sketches.values()],
+                index=list(self.sketches), columns=["q1", "median", "q3", "rank_error"])
+            grouped = self.extremes.join(quartiles)
+        else:
+            quartiles = self.sample.groupby(self.x_col)[self.y_col].quantile([0.25, 0.5, 0.75]).unstack()
+            grouped = self.extremes.join(quartiles.rename(columns={0.25: "q1", 0.5: "median", 0.75: "q3"}))
+        grouped = grouped.rename_axis(self.x_col).reset_index()
+
+        # Prefer more-representative categories when there are many.
+        grouped = grouped.sort_values(by="count", ascending=False).head(20)
+
+        # Frontend expects x-axis key "category"
+        columns = ["category", "min", "q1", "median", "q3", "max"] + (["rank_error"] if self.approximate else [])
+        grouped = grouped.rename(columns={self.x_col: "category"})[columns]
+        for c in ["min", "q1", "median", "q3", "max"]:
+            grouped[c] = grouped[c].astype(float)
+
+        chart["data"] = grouped.to_dict(orient="records")
+
+
+def _make_accumulator(chart, profiles, rng, approximate=False, sample_size=None):
+    """Mirrors the chart dispatch in chart_data."""
+    agg_type = chart.get("agg_type")
+    if agg_type in ("radar_mean", "multi_bar_mean"):
+        if chart.get("group_col") and chart.get("metrics"):
+            return _GroupMeans(chart)
+    elif agg_type == "scatter_group":
+        if chart.get("group_col"):
+            return _GroupedScatter(chart, rng, sample_size)
+    elif agg_type == "histogram":
+        return _Histogram(chart, profiles, approximate)
+    elif chart["type"] in ["bar", "pie", "treemap"]:
+        if (chart.get("x") or chart.get("nameKey")) and (chart.get("y") or chart.get("dataKey")):
+            return _GroupAggregate(chart)
+    elif chart["type"] in ["line", "area"]:
+        x_profile = profiles.get(chart["x"])
+        if x_profile is not None and x_profile.is_numeric:
+            return _NumericLine(chart)
+        return _DateLine(chart, profiles)
+    elif chart["type"] == "scatter":
+        return _Scatter(chart, rng, sample_size)
+    elif chart["type"] == "boxPlot":
+        if chart.get("x") in profiles and chart.get("y") in profiles:
+            return _BoxPlot(chart, rng, approximate)
+    return None
+
+
+class ChunkedAnalysis:
+    """
+    The mergeable state of a chunked analysis: column profiles, the charts
+    recommended from them, and one accumulator per chart. Chunks go through
+    profile() and then, once the charts are planned, aggregate() (or both at
+    once with append()). result() can be taken at any point after plan() and
+    leaves the state unchanged, so more chunks can follow; the state pickles,
+    so it can be stored between appends (see pipeline.append_rows).
+    """
+
+    def __init__(self, project_type: str = "general", seed: Optional[int] = DEFAULT_SEED,
+                 approximate: bool = False, sample_size: Optional[int] = None):
+        self.project_type = project_type
+        self.approximate = approximate
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        self.profiles: Dict[str, _ColumnProfile] = {}
+        self.row_count = 0
+        self.chunk_count = 0
+        self.recommendations: Optional[Dict[str, Any]] = None
+        self.accumulators: List[Tuple[int, Any]] = []
+        self.moments = CorrelationMoments()
+
+    def complete(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """chunk with the columns seen in earlier chunks but missing from it, as nulls."""
+        missing = [col for col in self.profiles if col not in chunk.columns]
+        if missing:
+            chunk = pd.concat([chunk, pd.DataFrame(np.nan, index=chunk.index, columns=missing)], axis=1)
+        return chunk
+
+    def profile(self, chunk: pd.DataFrame):
+        self.chunk_count += 1
+        numeric = [col for col in chunk.columns if col != RECORD_COUNT and pd.api.types.is_numeric_dtype(chunk[col])]
+        self.moments.update(chunk[numeric])
+        for col in chunk.columns:
+            if col not in self.profiles:
+                self.profiles[col] = _ColumnProfile(col, self.approximate)
+                # A column that first shows up now was missing from earlier rows
+                self.profiles[col].null_count += self.row_count
+            self.profiles[col].update(chunk[col])
+        self.row_count += len(chunk)
+
+    def analysis(self) -> Dict[str, Any]:
+        return {
+            "columns": [p.info(self.row_count) for p in self.profiles.values()],
+            "row_count": self.row_count
+        }
+
+    def correlation(self, analysis: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Correlations of the columns the profile found numeric (see correlation.py)."""
+        return self.moments.summary(correlation_columns(analysis))
+
+    def plan(self, analysis: Optional[Dict[str, Any]] = None):
+        """Recommends charts and KPIs from the profile and sets up the chart accumulators."""
+        analysis = analysis or self.analysis()
+        self.recommendations = recommend_charts(analysis, self.project_type, self.correlation(analysis))
+        accumulators = [(i, _make_accumulator(chart, self.profiles, self.rng, self.approximate, self.sample_size))
+                        for i, chart in enumerate(self.recommendations["charts"])]
+        self.accumulators = [(i, acc) for i, acc in accumulators if acc is not None]
+
+    def aggregate(self, chunk: pd.DataFrame):
+        for _, acc in self.accumulators:
+            acc.update(chunk)
+
+    def append(self, chunk: pd.DataFrame, timings: Optional[Timings] = None) -> Dict[str, Any]:
+        """
+        Adds new rows to every part of the state in one pass (the charts are
+        planned from the first chunk). Returns the updated analysis.
+        """
+        timings = timings or Timings()
+        chunk = self.complete(_normalize_chunk(chunk))
+        with timings.stage("profile"):
+            self.profile(chunk)
+            analysis = self.analysis()
+        if self.recommendations is None:
+            with timings.stage("recommend"):
+                self.plan(analysis)
+        with timings.stage("aggregate"):
+            self.aggregate(chunk)
+        return analysis
+
+    def result(self, timings: Optional[Timings] = None, analysis: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """{"analysis", "charts", "kpis", "metadata"} from the state so far."""
+        timings = timings or Timings()
+        analysis = analysis or self.analysis()
+        charts = copy.deepcopy(self.recommendations["charts"])
+        for i, acc in self.accumulators:
+            with timings.chart(charts[i]["type"]):
+                acc.finish(charts[i])
+
+        # Charts stay the ones planned; KPIs (and the row count) follow the
+        # current profile, so they are recommended again.
+        recommendations = recommend_charts(analysis, self.project_type, self.correlation(analysis))
+
+        # KPIs are column totals/means/distinct counts, all known from the profile
+        profiles = self.profiles
+
+        def stat(column, func):
+            profile = profiles[column]
+            if func == "nunique":
+                return profile.unique_count()
+            if not profile.is_numeric:
+                raise TypeError(f"Cannot aggregate non-numeric column '{column}'")
+            return profile.sum if func == "sum" else profile.mean()
+
+        def error(column, func):
+            return profiles[column].unique_count_error() if func == "nunique" else None
+
+        fill_kpis(recommendations["kpis"], stat, self.row_count, error)
+
+        metadata = dict(recommendations["metadata"])
+        if self.approximate:
+            metadata["approximate"] = describe_sketches()
+        else:
+            sketched = [p.name for p in profiles.values() if p.sketched]
+            if sketched:
+                # Columns past EXACT_UNIQUE_LIMIT distinct values
+                metadata["approximate"] = {
+                    "uniqueCounts": {**describe_sketches()["uniqueCounts"], "columns": sketched}
+                }
+
+        return {
+            "analysis": analysis,
+            "charts": charts,
+            "kpis": recommendations["kpis"],
+            "metadata": metadata
+        }
+
+
+def analyze_csv_chunked(source, project_type: str = "general", chunk_size: int = DEFAULT_CHUNK_SIZE,
+                        seed: Optional[int] = DEFAULT_SEED, timings: Optional[Timings] = None,
+                        approximate: bool = False, sample_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Analyzes a CSV file (path or seekable binary file object) without loading
+    it whole. Returns {"analysis", "charts", "kpis", "metadata"} with the same
+    layout as the in-memory /analyze pipeline. Samples are drawn with seed
+    (None for a fresh one each call); sample_size overrides the points per chart.
+    """
+    return analyze_chunks(lambda: _read_chunks(source, chunk_size), project_type, chunk_size, seed, timings,
+                          approximate, sample_size)
+
+
+def analyze_chunks(read_chunks: Callable[[], Iterable[pd.DataFrame]], project_type: Union[str, Callable[[], str]],
+                   chunk_size: int, seed: Optional[int] = DEFAULT_SEED, timings: Optional[Timings] = None,
+                   approximate: bool = False, sample_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    analyze_csv_chunked on any source of chunks: read_chunks() starts a new
+    pass over the data (it is read twice). project_type may be a function,
+    called once the first pass is done (for sources that carry it anywhere).
+    """
+    timings = timings or Timings()
+    state = ChunkedAnalysis("general", seed, approximate, sample_size)
+
+    # Pass 1: column profile
+    with timings.stage("profile"):
+        for chunk in read_chunks():
+            state.profile(state.complete(_normalize_chunk(chunk)))
+        analysis = state.analysis()
+    state.project_type = project_type() if callable(project_type) else project_type
+
+    with timings.stage("recommend"):
+        state.plan(analysis)
+
+    # Pass 2: chart aggregations
+    if state.accumulators:
+        with timings.stage("aggregate"):
+            for chunk in read_chunks():
+                state.aggregate(state.complete(_normalize_chunk(chunk)))
+
+    result = state.result(timings, analysis)
+    result["metadata"]["streaming"] = {"chunkSize": chunk_size, "chunks": state.chunk_count}
+    return result
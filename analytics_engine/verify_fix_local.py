@@ -13,6 +13,9 @@ sys.path.append('.')
 
 from analyzer import analyze_dataframe
 from chart_recommender import recommend_charts
+from chart_data import build_chart_data, summed_columns
+from dates import DateCache
+from ingest import compact_frame
 
 def test_retail_metrics():
     print("Testing Retail Data (Price/Quantity, no Revenue)...")
@@ -27,19 +30,41 @@ def test_retail_metrics():
     df = pd.DataFrame(data)
     df["Record Count"] = 1 # Simulate main.py injection
     
-    analysis = analyze_dataframe(df)
+    date_cache = DateCache()
+    analysis = analyze_dataframe(df, date_cache)
     print("Analysis Columns:", [c['name'] for c in analysis['columns']])
     
-    result = recommend_charts(analysis, df)
+    result = build_chart_data(recommend_charts(analysis), df, analysis, date_cache)
     
     kpis = result.get('kpis', [])
     print(f"KPIs generated: {len(kpis)}")
     for k in kpis:
         print(f"- {k['label']}: {k['value']} ({k['type']})")
 
+def test_string_valued_maintenance():
+    print("Testing Maintenance Data posted as strings (csv-parser rows)...")
+    data = [
+        {"Type": t, "Machine failure": f, "Torque [Nm]": q}
+        for t, f, q in [("L", "0", "40.1"), ("M", "1", "52.3"), ("H", "0", "38.0"), ("L", "1", "61.2")] * 5
+    ]
+    df = pd.DataFrame(data)
+    df["Record Count"] = 1 # Simulate main.py injection
+
+    date_cache = DateCache()
+    analysis = analyze_dataframe(df, date_cache)
+    recommendations = recommend_charts(analysis, "maintenance")
+    compact_frame(df, analysis, summed_columns(recommendations))
+    result = build_chart_data(recommendations, df, analysis, date_cache)
+
+    kpis = {k["label"]: k["value"] for k in result.get("kpis", [])}
+    print("KPIs:", kpis)
+    assert kpis["Total Failures"] == 10, kpis
+    assert kpis["Failure Rate"] == "50.0000%", kpis
+
 if __name__ == "__main__":
     try:
         test_retail_metrics()
+        test_string_valued_maintenance()
     except Exception as e:
         print(f"CRASH: {e}")
         import traceback
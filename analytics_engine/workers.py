@@ -0,0 +1,201 @@
+"""
+Runs analysis jobs in worker processes so the event loop stays free.
+
+Each worker is a single-process executor ("slot"). A job waits for an idle
+slot; at most queue_size jobs may wait, beyond that the pool is saturated.
+A job that exceeds the timeout has its worker process killed and the slot
+replaced, without affecting jobs running on the other slots.
+
+Worker processes are forked where the platform allows it, so they share the
+parent's loaded modules (pandas, numpy, ...) and warmed-up state copy-on-write
+instead of importing them again.
+"""
+import asyncio
+import multiprocessing
+import os
+import signal
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from typing import Any, Callable, Deque, List, Optional
+
+_MP_CONTEXT = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+
+
+class PoolSaturated(Exception):
+    """Every worker is busy and the wait queue is full."""
+
+
+class JobTimeout(Exception):
+    """A job ran longer than the pool's timeout and its worker was killed."""
+
+
+class _JobError(Exception):
+    """
+    Carries an HTTP error out of a worker process: HTTPException and
+    RequestValidationError can not be unpickled, this can.
+    """
+
+    def __init__(self, status_code: int, detail: Any, headers: Optional[dict] = None, validation_errors: Optional[list] = None):
+        super().__init__(status_code, detail, headers, validation_errors)
+        self.status_code = status_code
+        self.detail = detail
+        self.headers = headers
+        self.validation_errors = validation_errors
+
+    def reraise(self):
+        if self.validation_errors is not None:
+            raise RequestValidationError(self.validation_errors)
+        raise HTTPException(status_code=self.status_code, detail=self.detail, headers=self.headers)
+
+
+def _init_worker():
+    # A forked worker inherits the server's signal handlers (uvicorn's only set
+    # a flag), which would make terminate() a no-op. Ctrl+C is left to the
+    # server, which stops the workers itself.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _call(fn: Callable, args: tuple):
+    # Runs in the worker process
+    try:
+        return fn(*args)
+    except RequestValidationError as e:
+        raise _JobError(422, None, validation_errors=list(e.errors()))
+    except HTTPException as e:
+        raise _JobError(e.status_code, e.detail, e.headers)
+
+
+class _Slot:
+    def __init__(self):
+        self.executor = ProcessPoolExecutor(max_workers=1, mp_context=_MP_CONTEXT, initializer=_init_worker)
+        self.broken = False
+
+    def kill(self):
+        self.broken = True
+        for process in list((self.executor._processes or {}).values()):
+            process.terminate()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class WorkerPool:
+    """
+    workers=0 runs jobs inline on the event loop (no processes, handy for
+    development and debugging).
+    """
+
+    def __init__(self, workers: int, queue_size: int, timeout: float):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._slots: List[_Slot] = [_Slot() for _ in range(workers)]
+        self._idle: List[_Slot] = list(self._slots)
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.running = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def start(self, warm_up: Callable = os.getpid):
+        """
+        Starts every worker process now rather than on its first job, and
+        runs warm_up() in each.
+        """
+        await asyncio.gather(*(asyncio.wrap_future(slot.executor.submit(warm_up)) for slot in self._slots))
+
+    async def run(self, fn: Callable, *args):
+        """
+        Runs fn(*args) in a worker and returns its result. Raises
+        PoolSaturated, JobTimeout, or the HTTP error fn raised.
+        """
+        if self.workers == 0:
+            return fn(*args)
+
+        slot = await self._acquire()
+        self.running += 1
+        loop = asyncio.get_running_loop()
+        try:
+            future = slot.executor.submit(_call, fn, args)
+        except BrokenProcessPool:
+            self.running -= 1
+            self._release(self._replace(slot))
+            raise
+        # The slot goes back to the pool when the worker is done with the job,
+        # even if the request has given up on it.
+        future.add_done_callback(lambda f: self._finished(loop, slot, f))
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            slot.kill()
+            raise JobTimeout(f"Analysis did not finish within {self.timeout:g}s")
+        except _JobError as e:
+            e.reraise()
+
+    def _finished(self, loop, slot: _Slot, future):
+        # Executor thread: hand back to the event loop
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            slot.broken = True
+        try:
+            loop.call_soon_threadsafe(self._done, slot)
+        except RuntimeError:
+            pass  # loop already closed
+
+    def _done(self, slot: _Slot):
+        self.running -= 1
+        self._release(self._replace(slot) if slot.broken else slot)
+
+    def _replace(self, slot: _Slot) -> _Slot:
+        slot.kill()
+        new_slot = _Slot()
+        self._slots[self._slots.index(slot)] = new_slot
+        return new_slot
+
+    async def _acquire(self) -> _Slot:
+        if self._idle:
+            return self._idle.pop()
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            raise PoolSaturated("All workers are busy")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(waiter.result())
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def _release(self, slot: _Slot):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(slot)
+                return
+        self._idle.append(slot)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "queueSize": self.queue_size,
+            "rejected": self.rejected,
+            "timedOut": self.timed_out,
+        }
+
+    def shutdown(self):
+        # Terminated rather than left to exit on their own: a worker that does
+        # not get the exit sentinel would outlive the server (and keep its
+        # inherited listening socket open)
+        for slot in self._slots:
+            slot.kill()